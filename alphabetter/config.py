@@ -12,8 +12,12 @@ class AppConfig:
     default_source: ClassVar[Path] = Path(__file__).parent.parent / 'configs' / 'app.yaml'
     version: str
     db_url: str
+    db_pool_size: int
+    db_max_overflow: int
     progress_bar_class: Optional[Type]
     data_dir: Path
+    dataset_format: str
+    selection_cache_size_mb: int
     championat_config_path: Path
     line4bet_config_path: Path
     fonbet_config_path: Path
@@ -47,9 +51,13 @@ class AppConfig:
                 raise ValueError(f'Invalid progress bar "{progress_bar_data}".')
         return cls(
             db_url=data['db'],
+            db_pool_size=data['db_pool']['size'],
+            db_max_overflow=data['db_pool']['max_overflow'],
             version=data['version'],
             progress_bar_class=progress_bar_class,
             data_dir=cls._parse_path(data['data_dir']),
+            dataset_format=data['dataset_format'],
+            selection_cache_size_mb=data['selection_cache_size_mb'],
             championat_config_path=cls._parse_path(data['championat_config']),
             line4bet_config_path=cls._parse_path(data['line4bet_config']),
             fonbet_config_path=cls._parse_path(data['fonbet_config']),
@@ -10,6 +10,7 @@ from alphabetter.core.text import (
     humanize_season_count,
     wrap_text_middle,
 )
+from alphabetter.core.similarity import TeamNameSimilarity
 from alphabetter.core.ui import create_progress_bar
 from alphabetter.core.df import (
     abbreviate_columns,
@@ -2,65 +2,119 @@
 
 import pandas as pd
 
-from datetime import date
+from datetime import date, datetime, time, timedelta
 from alphabetter.core.model import *
 from alphabetter.sql import *
 from alphabetter.web import *
-from typing import Dict
-from sqlalchemy import cast, Date
+from typing import Dict, List, Tuple
+from uuid import UUID
+from sqlalchemy.orm import selectinload, joinedload
 from alphabetter.core.logging import LOG_LEVEL_STATUS
 
 import logging
 
 
+_odds_columns = ['1', 'X', '2', '1X', '12', '2X']
+
+
+def _get_match_key(match: Match) -> Tuple:
+    return (
+        match.played_at,
+        match.home_team.country,
+        match.home_team.name,
+        match.away_team.country,
+        match.away_team.name,
+    )
+
+
+def _reload_tournament(sql_session: SQLSession, tournament: Tournament):
+    stored_tournament = (
+        sql_session
+        .query(Tournament)
+        .filter_by(season=tournament.season)
+        .join(League)
+        .filter_by(sport=tournament.league.sport, name=tournament.league.name)
+        .options(selectinload(Tournament.matches).options(
+            joinedload(Match.home_team),
+            joinedload(Match.away_team),
+        ))
+        .one_or_none()
+    )
+    if not stored_tournament:
+        sql_session.merge(tournament)
+        sql_session.flush()
+        return
+    # Matches are diffed by their natural key, so unchanged ones, with their odds, are left untouched.
+    stored_matches = {_get_match_key(match): match for match in stored_tournament.matches}
+    merged_teams: Dict[Tuple, Team] = {}
+    def merge_team(team: Team) -> Team:
+        team_key = (team.sport, team.country, team.name)
+        if team_key not in merged_teams:
+            merged_teams[team_key] = sql_session.merge(team)
+        return merged_teams[team_key]
+    inserted_match_count = 0
+    updated_match_count = 0
+    for match_key, match in {_get_match_key(match): match for match in tournament.matches}.items():
+        stored_match = stored_matches.pop(match_key, None)
+        if stored_match is None:
+            # The match is added to the stored tournament by the backref.
+            Match(
+                tournament=stored_tournament,
+                played_at=match.played_at,
+                home_team=merge_team(match.home_team),
+                away_team=merge_team(match.away_team),
+                home_points=match.home_points,
+                away_points=match.away_points,
+            )
+            inserted_match_count += 1
+        elif (stored_match.home_points, stored_match.away_points) != (match.home_points, match.away_points):
+            stored_match.home_points = match.home_points
+            stored_match.away_points = match.away_points
+            # Cached and incremental dataset selections detect changed matches by the loading time.
+            stored_match.loaded_at = datetime.now()
+            updated_match_count += 1
+    # Fixtures gone from the source, e.g. rescheduled ones, are deleted with their odds.
+    for stored_match in stored_matches.values():
+        sql_session.delete(stored_match)
+    # Without autoflush, teams merged by other tournaments of the league are found only once flushed.
+    sql_session.flush()
+    logging.info(
+        f'Inserted {inserted_match_count}, updated {updated_match_count} and deleted {len(stored_matches)} '
+        f'matches of the {stored_tournament}.'
+    )
+
+
 async def process_championat_tournament(
     championat_client: ChampionatClient,
-    sql_session: SQLSession,
+    sql_session: AsyncSQLSession,
     sport: Sport,
     league_name: str,
     season: str,
 ) -> Tournament:
     league = League(sport=sport, name=league_name)
-    tournament = (
-        sql_session
-        .query(Tournament)
-        .filter_by(season=season)
-        .join(League)
-        .filter_by(sport=sport, name=league_name)
-        .one_or_none()
-    )
-    # TODO: Allow disable deletion
-    if tournament:
-        logging.log(LOG_LEVEL_STATUS, f'Deleting the {tournament}...')
-        sql_session.delete(tournament)
-        logging.info(f'Deleted the {tournament}.')
     tournament = Tournament(league=league, season=season)
     df = await championat_client.download_tournament(sport, league_name, season)
+    # Matches of a team share its object, as a merge doesn't find unflushed teams by their keys.
+    teams: Dict[Tuple, Team] = {}
+    def get_team(country: Country, name: str) -> Team:
+        return teams.setdefault((country, name), Team(sport=sport, country=country, name=name))
+    # Matches are added to the tournament by the backref.
     for row in df.itertuples():
-        match = Match(
+        Match(
             tournament=tournament,
             played_at=row.played_at,
-            home_team=Team(
-                sport=tournament.league.sport,
-                country=Country(row.home_country),
-                name=row.home_team,
-            ),
-            away_team=Team(
-                sport=tournament.league.sport,
-                country=Country(row.home_country),
-                name=row.away_team,
-            ),
+            home_team=get_team(Country(row.home_country), row.home_team),
+            away_team=get_team(Country(row.home_country), row.away_team),
             home_points=row.home_points,
             away_points=row.away_points,
         )
-        tournament.matches.append(match)
-    sql_session.merge(tournament)
+    await sql_session.run_sync(_reload_tournament, tournament)
     return tournament
 
 
 async def process_line4bet_odds(
     line4bet_client: Line4BetClient,
-    sql_session: SQLSession,
+    sql_session: AsyncSQLSession,
     bookmaker: Bookmaker,
     sport: Sport,
     match_date: date,
@@ -77,15 +131,26 @@ async def process_line4bet_odds(
         },
         index=pd.Index(line4bet_client.config.get_league_names(sport), name='league'),
     )
-    stored_matches: Dict[str, set] = {}
-    matches_with_odds: Dict[str, set] = {}
+    # Matches are keyed by their IDs, as hashing them would load their tournaments on the event loop
+    # thread, while the session may be used only by its own thread.
+    stored_matches: Dict[str, Dict[UUID, Match]] = {}
+    matches_with_odds: Dict[str, Dict[UUID, Match]] = {}
+    odds_dfs = []
+    played_from = datetime.combine(match_date, time.min)
+    played_to = datetime.combine(match_date, time.max)
+    # Matches are looked up in memory, within a day of the date.
+    match_resolver = await sql_session.get_match_resolver(
+        sport,
+        played_from - timedelta(days=1),
+        played_to + timedelta(days=1),
+        line4bet_client.config.get_league_names(sport),
+        source='line4bet',
+    )
     for league_name in line4bet_client.config.get_league_names(sport):
-        stored_matches[league_name] = set((sql_session
-            .query(Match).filter(cast(Match.played_at, Date) == match_date)
-            .join(Tournament)
-            .join(League).filter(League.sport == sport, League.name == league_name)
-            .all()
-        ))
+        stored_matches[league_name] = {
+            match.id: match # type: ignore
+            for match in match_resolver.get_matches(league_name, played_from, played_to)
+        }
         summary_df.loc[league_name, 'stored_matches'] = len(stored_matches[league_name])
     if all(not league_stored_matches for league_stored_matches in stored_matches.values()):
         logging.info(f'No matches found in the database for {match_date:%b %d, %Y}.')
@@ -95,6 +160,7 @@ async def process_line4bet_odds(
         bookmaker=bookmaker,
         match_date=match_date,
     )
+    league_events: Dict[str, List[Line4BetClient.OddsDownloaded]] = {}
     async for event in event_generator:
         match event:
             case Line4BetClient.LeagueHeaderScanned(league_header):
@@ -105,44 +171,56 @@ async def process_line4bet_odds(
             case Line4BetClient.NoOddsScansWarning(league_name, match_data):
                 logging.warning(f'No scans of {bookmaker} odds are available for the {league_name} {sport:_} {match_data:_}.')
                 summary_df.loc[league_name, 'scanned_matches_without_odds'] += 1 # type: ignore
-            case Line4BetClient.OddsDownloaded(league_name, match_data, odds_scans):
+            case Line4BetClient.OddsDownloaded(league_name):
                 summary_df.loc[league_name, 'scanned_matches'] += 1 # type: ignore
-                match = sql_session.find_match(
-                    sport=sport,
-                    league_name=league_name,
-                    played_at=match_data.played_at,
-                    home_team_name=match_data.home_team,
-                    away_team_name=match_data.away_team,
-                )
-                if not match:
-                    logging.error(f'The {league_name} {sport:_} {match_data:_} is not found in the database.')
+                league_events.setdefault(league_name, []).append(event)
+    for league_name, events in league_events.items():
+        # Matches of the whole date are resolved together, so that two of them, even on different pages,
+        # can't claim the same match and write its scans twice.
+        matches = match_resolver.find_matches(league_name, [event.match_info for event in events])
+        for event, match in zip(events, matches):
+            match_data = event.match_info
+            odds_scans = event.odds_scans
+            if not match:
+                logging.error(f'The {league_name} {sport:_} {match_data:_} is not found in the database.')
+                continue
+            # Pages of the date follow the timezone of the site, so a match played just outside the date,
+            # which is found in the wider period of the resolver, is counted with the stored ones.
+            if match.id not in stored_matches[league_name]: # type: ignore
+                stored_matches[league_name][match.id] = match # type: ignore
+                summary_df.loc[league_name, 'stored_matches'] += 1 # type: ignore
+            matches_with_odds.setdefault(league_name, {})[match.id] = match # type: ignore
+            summary_df.loc[league_name, 'matched_matches'] += 1 # type: ignore
+            odds_dfs.append(
+                odds_scans[_odds_columns]
+                .rename_axis('scanned_at')
+                .reset_index()
+                .assign(bookmaker=bookmaker, match_id=match.id)
+            )
+            logging.info(
+                f'Found {len(odds_scans)} scans of {bookmaker} odds for '
+                f'the {league_name} {sport:_} {match_data:_}.'
+            )
+            summary_df.loc[league_name, 'odds_scans'] += len(odds_scans) # type: ignore
+    # Scans of the whole date are written at once, replacing the earlier scans of the bookmaker.
+    if odds_dfs:
+        await sql_session.write_odds(pd.concat(odds_dfs, ignore_index=True), replace=True)
+    await sql_session.write_team_aliases(match_resolver)
+    await sql_session.refresh_latest_odds([
+        match
+        for league_matches_with_odds in matches_with_odds.values()
+        for match in league_matches_with_odds.values()
+    ])
+    def warn_about_stored_matches_without_odds(_: SQLSession):
+        for league_name, stored_league_matches in stored_matches.items():
+            league_matches_with_odds = matches_with_odds.get(league_name, {})
+            for match_id, match in stored_league_matches.items():
+                if match_id in league_matches_with_odds:
                     continue
-                matches_with_odds.setdefault(league_name, set()).add(match)
-                summary_df.loc[league_name, 'matched_matches'] += 1 # type: ignore
-                match.odds.clear()
-                for scanned_at, odds in odds_scans.iterrows():
-                    odds = Odds(
-                        bookmaker=bookmaker,
-                        scanned_at=scanned_at.to_pydatetime(), # type: ignore
-                        home_win=odds['1'],
-                        draw=odds['X'],
-                        away_win=odds['2'],
-                        home_win_or_draw=odds['1X'],
-                        win=odds['12'],
-                        away_win_or_draw=odds['2X'],
-                    )
-                    match.odds.append(odds)
-                logging.info(
-                    f'Found {len(odds_scans)} scans of {bookmaker} odds for '
-                    f'the {league_name} {sport:_} {match_data:_}.'
-                )
-                summary_df.loc[league_name, 'odds_scans'] += len(odds_scans) # type: ignore
-    for league_name, stored_league_matches in stored_matches.items():
-        league_matches_with_odds = matches_with_odds.get(league_name, set())
-        stored_league_matches_without_odds = stored_league_matches - league_matches_with_odds
-        for match in stored_league_matches_without_odds:
-            logging.warning(f'The {league_name} {sport:_} {match:_} has no scans of {bookmaker} odds.')
-            summary_df.loc[league_name, 'stored_matches_without_odds'] += 1 # type: ignore
+                logging.warning(f'The {league_name} {sport:_} {match:_} has no scans of {bookmaker} odds.')
+                summary_df.loc[league_name, 'stored_matches_without_odds'] += 1 # type: ignore
+    # Matches are formatted in the session thread, which may load their attributes.
+    await sql_session.run_sync(warn_about_stored_matches_without_odds)
     return summary_df
 
 
@@ -155,14 +233,26 @@ def process_fonbet_odds(
     upcoming_match_dataset = fonbet_client.download_upcoming_matches(sport, league_name)
     upcoming_match_dataset.insert(3, 'found_in_database', False)
     odds_scanned_at = datetime.now()
-    for match_index, match_data in upcoming_match_dataset.iterrows():
-        match = sql_session.find_match(
-            sport=sport,
-            league_name=league_name,
+    matches_with_odds = []
+    odds_rows = []
+    if upcoming_match_dataset.empty:
+        return upcoming_match_dataset
+    match_resolver = sql_session.get_match_resolver(
+        sport,
+        upcoming_match_dataset['match.played_at'].min() - timedelta(days=1),
+        upcoming_match_dataset['match.played_at'].max() + timedelta(days=1),
+        [league_name],
+        source='fonbet',
+    )
+    matches = match_resolver.find_matches(league_name, [
+        MatchInfo(
             played_at=match_data['match.played_at'],
-            home_team_name=match_data['match.home_team'],
-            away_team_name=match_data['match.away_team'],
+            home_team=match_data['match.home_team'],
+            away_team=match_data['match.away_team'],
         )
+        for _, match_data in upcoming_match_dataset.iterrows()
+    ])
+    for (match_index, match_data), match in zip(upcoming_match_dataset.iterrows(), matches):
         if not match:
             error_message = (
                 f'The {league_name} {sport:_} match '
@@ -173,15 +263,14 @@ def process_fonbet_odds(
             logging.error(error_message)
             continue
         upcoming_match_dataset.loc[match_index, 'found_in_database'] = True # type: ignore
-        odds = Odds(
-            bookmaker=Bookmaker.FONBET,
-            scanned_at=odds_scanned_at,
-            home_win=match_data['odds.1'],
-            draw=match_data['odds.X'],
-            away_win=match_data['odds.2'],
-            home_win_or_draw=match_data['odds.1X'],
-            win=match_data['odds.12'],
-            away_win_or_draw=match_data['odds.2X'],
-        )
-        match.odds.append(odds)
+        odds_rows.append({
+            'bookmaker': Bookmaker.FONBET,
+            'match_id': match.id,
+            'scanned_at': odds_scanned_at,
+            **{column: match_data[f'odds.{column}'] for column in _odds_columns},
+        })
+        matches_with_odds.append(match)
+    sql_session.write_odds(pd.DataFrame(odds_rows))
+    sql_session.write_team_aliases(match_resolver)
+    sql_session.refresh_latest_odds(matches_with_odds)
     return upcoming_match_dataset
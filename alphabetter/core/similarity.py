@@ -0,0 +1,74 @@
+''' Fuzzy similarity of team names. '''
+
+import numpy as np
+import re
+
+from functools import lru_cache
+from typing import Iterable, List
+
+
+_ngram_size = 2
+
+
+def tokenize_team_name(name: str, /) -> List[str]:
+    # Spellings differ by case, punctuation and the optional "ё" of Russian names.
+    return re.findall(r'\w+', name.casefold().replace('ё', 'е'))
+
+
+def _get_ngrams(tokens: List[str]) -> List[str]:
+    ngrams = []
+    for token in tokens:
+        # Padding marks the boundaries of a token, so that the order of tokens doesn't matter.
+        padded_token = f' {token} '
+        ngrams.extend(padded_token[i:i + _ngram_size] for i in range(len(padded_token) - _ngram_size + 1))
+    return ngrams
+
+
+class TeamNameSimilarity:
+    '''
+    Similarity of scraped team names to a fixed set of team names.
+
+    The similarity is the Dice coefficient of character bigrams of the tokens of the names. Like the
+    ratio of SequenceMatcher, it's 2 * common / total, so it's 1 for equal names and 0 for names with
+    nothing in common. Bigrams of the teams are counted once, and a scraped name is scored against
+    all the teams at once. Scores of recently scraped names are cached.
+    '''
+
+    def __init__(self, team_names: Iterable[str], cache_size: int = 1024):
+        self.team_names = list(dict.fromkeys(team_names))
+        self._team_indices = {team_name: i for i, team_name in enumerate(self.team_names)}
+        team_ngrams = [_get_ngrams(tokenize_team_name(team_name)) for team_name in self.team_names]
+        self._ngram_indices = {}
+        for ngrams in team_ngrams:
+            for ngram in ngrams:
+                self._ngram_indices.setdefault(ngram, len(self._ngram_indices))
+        self._ngram_counts = np.zeros((len(self.team_names), len(self._ngram_indices)), dtype=np.int32)
+        for i, ngrams in enumerate(team_ngrams):
+            np.add.at(self._ngram_counts[i], [self._ngram_indices[ngram] for ngram in ngrams], 1)
+        self._ngram_totals = self._ngram_counts.sum(axis=1)
+        self.get_similarities = lru_cache(maxsize=cache_size)(self._get_similarities)
+
+    def get_team_index(self, team_name: str) -> int:
+        return self._team_indices[team_name]
+
+    def _get_similarities(self, scraped_team_name: str) -> np.ndarray:
+        ngrams = _get_ngrams(tokenize_team_name(scraped_team_name))
+        ngram_counts = np.zeros(len(self._ngram_indices), dtype=np.int32)
+        for ngram in ngrams:
+            # Bigrams unknown to the teams count only to the total.
+            if (ngram_index := self._ngram_indices.get(ngram)) is not None:
+                ngram_counts[ngram_index] += 1
+        common_ngram_counts = np.minimum(self._ngram_counts, ngram_counts).sum(axis=1)
+        ngram_totals = self._ngram_totals + len(ngrams)
+        similarities = np.divide(
+            2 * common_ngram_counts,
+            ngram_totals,
+            out=np.zeros(len(self.team_names)),
+            where=ngram_totals > 0,
+        )
+        # The cached array is shared by the callers.
+        similarities.flags.writeable = False
+        return similarities
+
+    def get_similarity(self, team_name: str, scraped_team_name: str) -> float:
+        return float(self.get_similarities(scraped_team_name)[self._team_indices[team_name]])
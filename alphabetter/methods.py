@@ -4,6 +4,7 @@ import pandas as pd
 import aiohttp
 import asyncio
 import humanize
+import time
 import selenium.webdriver
 import selenium.webdriver.firefox.options
 
@@ -13,8 +14,9 @@ from datetime import datetime, timedelta, date
 from pathlib import Path
 from alphabetter.web import *
 from alphabetter.core import *
-from alphabetter.sql import SQLSession
+from alphabetter.sql import SQLSession, AsyncSQLSession
 from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from difflib import SequenceMatcher
 from alphabetter.ml import *
 
 import logging
@@ -57,7 +59,7 @@ async def etl_championat_tournaments(
         unit='league',
         disable=(len(league_keys) == 1),
     )
-    sql_session = SQLSession.from_url()
+    sql_session = AsyncSQLSession.from_url(etl=True)
     summary_list = []
     summary_df = None
     def build_summary_df():
@@ -116,7 +118,7 @@ async def etl_championat_tournaments(
                             tournament,
                         ),
                     )
-                sql_session.commit()
+                await sql_session.commit()
         build_summary_df()
         return summary_df
     except BaseException as exception:
@@ -166,12 +168,6 @@ async def etl_line4bet_odds(
                 del league_headers[league_name]
     bookmakers = bookmakers or line4bet_config.get_bookmakers()
     dates = [min_date + timedelta(days=i) for i in range((max_date - min_date).days + 1)]
-    sport_progress_bar = create_progress_bar(
-        iterable=sports,
-        total=len(sports),
-        unit='sport',
-        disable=(len(sports) == 1),
-    )
     bookmaker_progress_bar = create_progress_bar(
         iterable=bookmakers,
         total=len(bookmakers),
@@ -184,7 +180,7 @@ async def etl_line4bet_odds(
         unit='date',
         disable=(len(dates) == 1),
     )
-    sql_session = SQLSession.from_url()
+    sql_session = AsyncSQLSession.from_url(etl=True)
     summary_list = []
     summary_df = None
     def build_summary_df():
@@ -225,7 +221,7 @@ async def etl_line4bet_odds(
                     date_progress_bar.set_description(match_date.isoformat())
                     for bookmaker in bookmaker_progress_bar:
                         bookmaker_progress_bar.set_description(str(bookmaker))
-                        for sport in sport_progress_bar:
+                        async def process_sport(sport: Sport) -> Tuple[Sport, pd.DataFrame]:
                             logging.log(
                                 LOG_LEVEL_STATUS,
                                 'Searching {} odds for {:_} matches of {:%b %d, %Y}...'.format(
@@ -234,7 +230,6 @@ async def etl_line4bet_odds(
                                     match_date
                                 ),
                             )
-                            sport_progress_bar.set_description(str(sport))
                             summary_df = await process_line4bet_odds(
                                 line4bet_client=line4bet_client,
                                 sql_session=sql_session,
@@ -242,13 +237,24 @@ async def etl_line4bet_odds(
                                 bookmaker=bookmaker,
                                 match_date=match_date,
                             )
+                            return sport, summary_df
+                        # Sports are processed concurrently, so that downloads of some overlap with the
+                        # database work for the others.
+                        sport_progress_bar = create_progress_bar(
+                            iterable=asyncio.as_completed([process_sport(sport) for sport in sports]),
+                            total=len(sports),
+                            unit='sport',
+                            disable=(len(sports) == 1),
+                        )
+                        for sport_etl_coro in sport_progress_bar:
+                            sport, summary_df = await sport_etl_coro
                             date_scans_of_odds_count += summary_df.odds_scans.sum()
                             summary_df.insert(0, 'date', match_date) # type: ignore
                             summary_df.insert(1, 'bookmaker', str(bookmaker))
                             summary_df.insert(2, 'sport', str(sport))
                             summary_list.append(summary_df)
                             last_date = match_date
-                    sql_session.commit()
+                    await sql_session.commit()
                     logging.info(
                         'Loaded {:,} scans of odds for {:%b %d, %Y}.'.format(
                             date_scans_of_odds_count,
@@ -313,8 +319,9 @@ async def etl_fonbet_odds(
     firefox_options.headless = True
     def process_league_key(league_key: Tuple[Sport, str]):
         sport, league_name = league_key
-        sql_session = SQLSession.from_url()
-        with selenium.webdriver.Firefox(options=firefox_options) as firefox:
+        # Sessions of the worker threads share the pooled engine, so the connection is returned to
+        # the pool when the league is processed.
+        with SQLSession.from_url(etl=True) as sql_session, selenium.webdriver.Firefox(options=firefox_options) as firefox:
             fonbet_client = FonbetClient(
                 config=fonbet_config,
                 webdriver=firefox,
@@ -407,6 +414,67 @@ async def etl_fonbet_odds(
         )
 
 
+def benchmark_team_name_similarity(
+    *,
+    config_path: Optional[Path] = None,
+    repeat: int = 10,
+) -> pd.DataFrame:
+    ''' Compares SequenceMatcher with TeamNameSimilarity on the team aliases of the championat config. '''
+    with open(config_path or config.championat_config_path) as championat_config_file:
+        championat_config = ChampionatClient.Config.from_yaml(championat_config_file)
+    # Aliases are scored against all the aliased teams of their sport, as scraped names are scored
+    # against all the teams of a league.
+    cases = []
+    for country_team_aliases in championat_config.team_aliases.values():
+        team_names = [team_name for team_aliases in country_team_aliases.values() for team_name in team_aliases]
+        cases.append((team_names, [
+            (alias, team_name)
+            for team_aliases in country_team_aliases.values()
+            for team_name, aliases in team_aliases.items()
+            for alias in aliases
+        ]))
+    # Similarities are computed once per set of teams, like they are by a match resolver per league.
+    team_name_similarities = {tuple(team_names): TeamNameSimilarity(team_names) for team_names, _ in cases}
+    uncached_team_name_similarities = {
+        tuple(team_names): TeamNameSimilarity(team_names, cache_size=0)
+        for team_names, _ in cases
+    }
+    def score_with_sequence_matcher(team_names, alias):
+        return [SequenceMatcher(None, team_name, alias).ratio() for team_name in team_names]
+    def score_uncached(team_names, alias):
+        return uncached_team_name_similarities[tuple(team_names)].get_similarities(alias)
+    def score_cached(team_names, alias):
+        return team_name_similarities[tuple(team_names)].get_similarities(alias)
+    rows = []
+    for method, score in [
+        ('SequenceMatcher', score_with_sequence_matcher),
+        ('TeamNameSimilarity', score_uncached),
+        ('TeamNameSimilarity (cached)', score_cached),
+    ]:
+        # The first pass fills the cache and collects the scores, the rest are timed.
+        true_scores = []
+        hits = 0
+        for team_names, alias_team_names in cases:
+            for alias, team_name in alias_team_names:
+                scores = score(team_names, alias)
+                true_scores.append(scores[team_names.index(team_name)])
+                hits += team_names[max(range(len(team_names)), key=lambda i: scores[i])] == team_name
+        started_at = time.perf_counter()
+        for _ in range(repeat):
+            for team_names, alias_team_names in cases:
+                for alias, _ in alias_team_names:
+                    score(team_names, alias)
+        duration = time.perf_counter() - started_at
+        rows.append({
+            'method': method,
+            'aliases': len(true_scores),
+            'us_per_alias': duration / repeat / len(true_scores) * 1e6,
+            'accuracy': hits / len(true_scores),
+            'true_similarity': sum(true_scores) / len(true_scores),
+        })
+    return pd.DataFrame(rows).set_index('method')
+
+
 @overload
 def recommend_bets(
     df: pd.DataFrame,
@@ -42,11 +42,18 @@ from alphabetter.ml.splitters.date import DateSplitter
 from alphabetter.ml.splitters.odds import OddsSplitter
 from alphabetter.ml.splitters.shuffle import ShuffleSplitter
 from alphabetter.ml.methods import (
+    DatasetKind,
+    DatasetFormat,
+    DatasetFilter,
+    LazyDataset,
     select_dataset,
+    select_dataset_chunks,
+    explain_select_dataset,
     read_dataset,
     read_match_dataset,
     read_predicted_match_dataset,
     read_bet_match_dataset,
+    search_datasets,
     save_dataset,
     save_match_dataset,
     save_predicted_match_dataset,
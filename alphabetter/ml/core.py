@@ -155,11 +155,15 @@ class Model(ABC):
     def __repr__(self):
         raise NotImplementedError()
 
+    @property
+    def default_name(self) -> str:
+        return str(UUID(md5(repr(self).encode('utf-8')).hexdigest()))
+
     def save(self, dir: Optional[Path] = None, name: Optional[str] = None) -> Path:
         if not dir:
             dir = config.data_dir / 'models' / self._get_subdir()
         if not name:
-            name = str(UUID(md5(repr(self).encode('utf-8')).hexdigest()))
+            name = self.default_name
         path = dir / (name + '.pickle')
         with open(path, 'wb') as file:
             pickle.dump(self, file)
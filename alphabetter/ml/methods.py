@@ -1,19 +1,31 @@
 ''' High-level methods for machine learning. '''
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import numpy as np
+import json
 import os
+import tempfile
+import sqlalchemy as sa
+import sqlite3
+import operator
 
 from alphabetter.config import default as config
 from pathlib import Path
-from typing import Optional, Set, Set, Dict, Any
-from datetime import datetime
+from typing import Optional, Set, Set, Dict, Any, Tuple, Iterator, Iterable, List, FrozenSet, Callable, Self
+from dataclasses import dataclass, replace
+from functools import partial, reduce
+from contextlib import closing
+from datetime import datetime, time
 from alphabetter.core import *
 from uuid import UUID
 from hashlib import md5
 from alphabetter.ml.core import *
 from datetime import datetime
-from alphabetter.sql import SQLSession
-from enum import Flag
+from alphabetter.sql import SQLSession, get_engine
+from enum import Enum, Flag
 
 import logging
 
@@ -25,8 +37,178 @@ class DatasetKind(Flag):
     ACCOUNTED_MATCH = 1 & 2 & 4 & 8
 
 
+class DatasetFormat(Enum):
+    CSV = 'csv'
+    PARQUET = 'parquet'
+    NUMPY = 'npy'
+    PARTITIONED = 'parts'
+    OVERLAY = 'overlay'
+
+    @property
+    def suffix(self) -> str:
+        return '.' + self.value
+
+
+@dataclass(frozen=True, kw_only=True)
+class DatasetFilter:
+    leagues: Optional[FrozenSet[str]] = None
+    seasons: Optional[FrozenSet[str]] = None
+    bookmakers: Optional[FrozenSet[Bookmaker]] = None
+    played_after: datetime = datetime.min
+    played_before: datetime = datetime.max
+
+    def narrow(
+        self,
+        *,
+        leagues: Optional[Iterable[str]] = None,
+        seasons: Optional[Iterable[str]] = None,
+        bookmakers: Optional[Iterable[Bookmaker]] = None,
+        played_after: Optional[datetime] = None,
+        played_before: Optional[datetime] = None,
+    ) -> Self:
+        def intersect(values, new_values):
+            if new_values is None:
+                return values
+            if values is None:
+                return frozenset(new_values)
+            return values & frozenset(new_values)
+        return replace(
+            self,
+            leagues=intersect(self.leagues, leagues),
+            seasons=intersect(self.seasons, seasons),
+            bookmakers=intersect(self.bookmakers, bookmakers),
+            played_after=max(self.played_after, played_after or datetime.min),
+            played_before=min(self.played_before, played_before or datetime.max),
+        )
+
+    @property
+    def key(self) -> Tuple[Any, ...]:
+        # Sets are sorted, so the key does not depend on the hash seed of the process.
+        return (
+            self.leagues is not None and tuple(sorted(self.leagues)),
+            self.seasons is not None and tuple(sorted(self.seasons)),
+            self.bookmakers is not None and tuple(sorted(bookmaker.name for bookmaker in self.bookmakers)),
+            self.played_after,
+            self.played_before,
+        )
+
+    @property
+    def columns(self) -> Set[str]:
+        columns = set()
+        if self.leagues is not None:
+            columns.add('match.league')
+        if self.seasons is not None:
+            columns.add('match.season')
+        if self.played_after > datetime.min or self.played_before < datetime.max:
+            columns.add('match.played_at')
+        return columns
+
+    def mask(self, df: pd.DataFrame, /) -> np.ndarray:
+        mask = np.ones(len(df), dtype=bool)
+        if self.leagues is not None:
+            mask &= np.asarray(df['match.league'].isin(self.leagues))
+        if self.seasons is not None:
+            mask &= np.asarray(df['match.season'].isin(self.seasons))
+        if self.bookmakers is not None:
+            if 'bookmaker' in df.index.names:
+                bookmakers = df.index.get_level_values('bookmaker')
+            else:
+                bookmakers = df['bookmaker']
+            # Matches without odds are kept, as they are by the selection query.
+            bookmaker_names = [str(bookmaker) for bookmaker in self.bookmakers]
+            mask &= np.asarray(bookmakers.isin(bookmaker_names)) | np.asarray(bookmakers.isna())
+        if self.played_after > datetime.min:
+            mask &= np.asarray(df['match.played_at'] >= self.played_after)
+        if self.played_before < datetime.max:
+            mask &= np.asarray(df['match.played_at'] <= self.played_before)
+        return mask
+
+    def to_arrow(self) -> Optional[ds.Expression]:
+        expressions = []
+        if self.leagues is not None:
+            expressions.append(ds.field('match.league').isin(sorted(self.leagues)))
+        if self.seasons is not None:
+            expressions.append(ds.field('match.season').isin(sorted(self.seasons)))
+        if self.bookmakers is not None:
+            bookmakers = sorted(str(bookmaker) for bookmaker in self.bookmakers)
+            expressions.append(ds.field('bookmaker').isin(bookmakers) | ds.field('bookmaker').is_null())
+        if self.played_after > datetime.min:
+            expressions.append(ds.field('match.played_at') >= self.played_after)
+        if self.played_before < datetime.max:
+            expressions.append(ds.field('match.played_at') <= self.played_before)
+        return reduce(operator.and_, expressions) if expressions else None
+
+
+class LazyDataset:
+    ''' Dataset that is loaded on first access to its data.
+
+    Filters and the column projection are passed to the loader, which pushes them down to the file
+    reader or to the selection query. Attributes of the loaded data frame, including the `match`,
+    `odds`, `prediction` and `bet` accessors, are available on the handle itself.
+    '''
+
+    def __init__(
+        self,
+        loader: Callable[[DatasetFilter, Optional[List[str]]], pd.DataFrame],
+        /,
+        filter: Optional[DatasetFilter] = None,
+        columns: Optional[List[str]] = None,
+    ):
+        self._loader = loader
+        self._filter = filter or DatasetFilter()
+        self._columns = columns
+        self._df: Optional[pd.DataFrame] = None
+
+    def filter(
+        self,
+        *,
+        leagues: Optional[Iterable[str]] = None,
+        seasons: Optional[Iterable[str]] = None,
+        bookmakers: Optional[Iterable[Bookmaker]] = None,
+        played_after: Optional[datetime] = None,
+        played_before: Optional[datetime] = None,
+    ) -> Self:
+        dataset_filter = self._filter.narrow(
+            leagues=leagues,
+            seasons=seasons,
+            bookmakers=bookmakers,
+            played_after=played_after,
+            played_before=played_before,
+        )
+        return type(self)(self._loader, dataset_filter, self._columns)
+
+    def select(self, columns: Iterable[str], /) -> Self:
+        columns = [column for column in columns if column not in _dataset_index_columns]
+        if self._columns is not None and (missing_columns := set(columns) - set(self._columns)):
+            raise KeyError(f'Columns {humanize_list(sorted(missing_columns))} are not selected.')
+        return type(self)(self._loader, self._filter, columns)
+
+    def collect(self) -> pd.DataFrame:
+        if self._df is None:
+            self._df = self._loader(self._filter, self._columns)
+        return self._df
+
+    def __getattr__(self, name: str, /) -> Any:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.collect(), name)
+
+    def __getitem__(self, key: Any, /) -> Any:
+        return self.collect()[key]
+
+    def __setitem__(self, key: Any, value: Any, /):
+        self.collect()[key] = value
+
+    def __len__(self) -> int:
+        return len(self.collect())
+
+    def __repr__(self):
+        state = 'loaded' if self._df is not None else 'not loaded'
+        return f'{self.__class__.__name__}({self._filter}, columns={self._columns}, {state})'
+
+
 _df_selection_query = '''
-    SELECT * FROM (
+    SELECT {columns} FROM (
         SELECT  match.id AS "match.id",
                 league.sport AS "match.sport",
                 league.name AS "match.league",
@@ -38,40 +220,79 @@ _df_selection_query = '''
                 away_team.name AS "match.away_team",
                 match.home_points AS "match.home_points",
                 match.away_points AS "match.away_points",
-                odds.bookmaker AS "bookmaker",
-                odds."1" AS "odds.1",
-                odds."X" AS "odds.X",
-                odds."2" AS "odds.2",
-                odds."1X" AS "odds.1X",
-                odds."12" AS "odds.12",
-                odds."2X" AS "odds.2X",
-                ROW_NUMBER() OVER(
-                    PARTITION BY match_id, odds.bookmaker ORDER BY odds.scanned_at DESC
-                ) AS "odds.scan_rank"
+                latest_odds.bookmaker AS "bookmaker",
+                latest_odds."1" AS "odds.1",
+                latest_odds."X" AS "odds.X",
+                latest_odds."2" AS "odds.2",
+                latest_odds."1X" AS "odds.1X",
+                latest_odds."12" AS "odds.12",
+                latest_odds."2X" AS "odds.2X"
         FROM (
             SELECT * FROM match
-            WHERE match.played_at BETWEEN %(played_after)s AND %(played_before)s
+            WHERE match.played_at BETWEEN %(played_after)s AND %(played_before)s{match_conditions}
         ) match
         JOIN tournament
-            ON match.tournament_id = tournament.id
+            ON match.tournament_id = tournament.id{tournament_conditions}
         JOIN league
-            ON tournament.league_id = league.id
+            ON tournament.league_id = league.id{league_conditions}
         JOIN team AS home_team
             ON home_team_id = home_team.id
         JOIN team AS away_team
             ON away_team_id = away_team.id
-        LEFT JOIN odds
-            ON odds.match_id = match.id
-            AND odds.bookmaker IN %(bookmakers)s
-            AND odds.scanned_at < match.played_at
+        LEFT JOIN latest_odds
+            ON latest_odds.match_id = match.id
+            AND latest_odds.bookmaker IN %(bookmakers)s
     ) a
-    WHERE bookmaker IS NULL OR "odds.scan_rank" = 1
     ORDER BY ("match.played_at", "bookmaker", "match.sport", "match.league")
     '''
 
+_match_id_selection_query = '''
+    SELECT match.id AS "match.id"
+    FROM match
+    JOIN tournament
+        ON match.tournament_id = tournament.id{tournament_conditions}
+    JOIN league
+        ON tournament.league_id = league.id{league_conditions}
+    WHERE match.played_at BETWEEN %(played_after)s AND %(played_before)s
+    '''
+
+_loaded_match_condition = '''
+            AND (
+                match.loaded_at > %(loaded_after)s
+                OR match.id IN (SELECT match_id FROM odds WHERE loaded_at > %(loaded_after)s)
+            )'''
+
+
+_league_condition = '''
+            AND league.name IN %(leagues)s'''
+
+_tournament_condition = '''
+            AND tournament.season IN %(seasons)s'''
+
+
+_watermark_query = '''
+    SELECT  (SELECT MAX(loaded_at) FROM match),
+            (SELECT COUNT(*) FROM match),
+            (SELECT MAX(loaded_at) FROM odds)
+    '''
+
+
+_dataset_index_columns = ['match.id', 'bookmaker']
+
+# Rows of selected datasets are ordered by these columns, as the selection query orders them.
+_dataset_order_columns = ['match.played_at', 'bookmaker', 'match.sport', 'match.league']
+
+_match_natural_key = [
+    'match.sport',
+    'match.league',
+    'match.season',
+    'match.played_at',
+    'match.home_team',
+    'match.away_team',
+]
 
 _match_column_dtypes = {
-    'match.id': 'a36',
+    'match.id': 'str',
     'match.sport': 'category',
     'match.league': 'category',
     'match.season': 'category',
@@ -114,128 +335,936 @@ _column_dtypes = {
     },
 }
 
-def read_dataset(
+_parquet_attrs_key = b'alphabetter'
+
+_parquet_overlay_key = b'alphabetter.overlay'
+
+_overlay_position_column = 'base.position'
+
+_numpy_meta_file_name = 'meta.json'
+
+_partition_columns = ['match.sport', 'match.league', 'match.season']
+
+# Files starting with an underscore are skipped by pyarrow when it discovers the partition files.
+_partitioned_meta_file_name = '_meta.json'
+
+_catalog_file_name = 'catalog.sqlite'
+
+_catalog_schema = '''
+    CREATE TABLE IF NOT EXISTS dataset (
+        path TEXT PRIMARY KEY,
+        dir TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        name TEXT NOT NULL,
+        format TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        length INTEGER NOT NULL,
+        played_from TEXT,
+        played_to TEXT,
+        size INTEGER NOT NULL,
+        attrs TEXT NOT NULL,
+        source TEXT,
+        query TEXT,
+        model TEXT
+    );
+    CREATE INDEX IF NOT EXISTS dataset_dir_created_at_idx ON dataset (dir, created_at);
+    CREATE INDEX IF NOT EXISTS dataset_name_idx ON dataset (name);
+    CREATE INDEX IF NOT EXISTS dataset_source_idx ON dataset (source);
+    CREATE INDEX IF NOT EXISTS dataset_model_idx ON dataset (model);
+    '''
+
+
+# Match UUIDs are interned into dense int32 surrogates, which are consistent across all datasets
+# of the process. Surrogates are converted back to UUIDs only when datasets are written.
+_match_uuids = pd.Index([], dtype=object)
+
+
+def _intern_match_uuids(uuids: pd.Index) -> np.ndarray:
+    global _match_uuids
+    match_ids = _match_uuids.get_indexer(uuids)
+    is_new = match_ids == -1
+    if is_new.any():
+        _match_uuids = _match_uuids.append(uuids[is_new].unique())
+        match_ids[is_new] = _match_uuids.get_indexer(uuids[is_new])
+    return match_ids.astype('i4')
+
+
+def match_uuids(match_ids: Iterable[int]) -> pd.Index:
+    return _match_uuids[np.asarray(match_ids)]
+
+
+def _encode_match_ids(df: pd.DataFrame):
+    level = df.index.levels[0]
+    if pd.api.types.is_integer_dtype(level.dtype):
+        return
+    match_ids = _intern_match_uuids(level.astype(str))
+    # A single level is passed as a list, as pandas can't tell an empty level from a list of levels.
+    df.index = df.index.set_levels([pd.Index(match_ids, dtype='i4')], level=['match.id'])
+
+
+def _decode_match_ids(df: pd.DataFrame) -> pd.DataFrame:
+    if not pd.api.types.is_integer_dtype(df.index.levels[0].dtype):
+        return df
+    attrs = df.attrs
+    df = df.copy(deep=False)
+    df.index = df.index.set_levels(match_uuids(df.index.levels[0]), level='match.id')
+    df.attrs = attrs
+    return df
+
+
+def _parse_dataset_attrs(raw_attrs: Dict[str, str]) -> Dict[str, Any]:
+    attrs = {}
+    for key, raw_value in raw_attrs.items():
+        match key:
+            case 'version':
+                value = raw_value
+            case 'created_at':
+                continue
+            case 'representativeness':
+                value = float(raw_value)
+            case 'match.per_day':
+                value = float(raw_value)
+            case 'loaded_at':
+                value = datetime.fromisoformat(raw_value)
+            case _:
+                logging.warning(f'Unknown dataset attribute "{key}".')
+                continue
+        attrs[key] = value
+    return attrs
+
+
+def _get_read_columns(dataset_filter: DatasetFilter, columns: Optional[List[str]]) -> Optional[List[str]]:
+    if columns is None:
+        return None
+    return list(dict.fromkeys([*columns, *sorted(dataset_filter.columns)]))
+
+
+def _filter_dataset(df: pd.DataFrame, dataset_filter: DatasetFilter, columns: Optional[List[str]]) -> pd.DataFrame:
+    attrs = df.attrs
+    if dataset_filter != DatasetFilter():
+        df = df.loc[dataset_filter.mask(df)]
+    if columns is not None:
+        df = df[columns]
+    df.attrs = attrs
+    return df
+
+
+def _read_csv_dataset(
+    path: Path,
     kind: DatasetKind,
-    dir: Path,
-    name: Optional[str] = None,
+    dataset_filter: DatasetFilter,
+    columns: Optional[List[str]],
 ) -> pd.DataFrame:
-    if not dir.is_absolute():
-        dir = config.data_dir / dir
-    if name:
-        path = dir / (name + '.csv')
-    else:
-        path = max(dir.glob('*.csv'), key=os.path.getctime)
+    # Only the projected columns and the columns the filter depends on are parsed.
+    read_columns = _get_read_columns(dataset_filter, columns)
+    usecols = None if read_columns is None else [*_dataset_index_columns, *read_columns]
     with open(path) as file:
-        attrs = {}
+        raw_attrs = {}
         file.readline()
         while True:
             line = file.readline().strip()
             if not line.startswith('#'):
                 break
             key, raw_value = map(str.strip, line[1:].split(':', 1))
-            match key:
-                case 'version':
-                    value = raw_value
-                case 'created_at':
-                    continue
-                case 'representativeness':
-                    value = float(raw_value)
-                case 'match.per_day':
-                    value = float(raw_value)
-                case _:
-                    logging.warning(f'Unknown dataset attribute "{key}".')
-                    continue
-            attrs[key] = value
+            raw_attrs[key] = raw_value
         assert line == ''
         df = pd.read_csv(
             file,
             low_memory=True,
-            index_col=['match.id', 'bookmaker'],
-            parse_dates=['match.played_at'],
-            dtype=_column_dtypes[kind], # type: ignore
+            usecols=usecols,
+            index_col=_dataset_index_columns,
+            parse_dates=[column for column in ['match.played_at'] if usecols is None or column in usecols],
+            dtype={
+                column: dtype
+                for column, dtype in _column_dtypes[kind].items()
+                if usecols is None or column in usecols
+            }, # type: ignore
         )
-    df.attrs = attrs
+    df.attrs = _parse_dataset_attrs(raw_attrs)
+    _encode_match_ids(df)
+    return _filter_dataset(df, dataset_filter, columns)
+
+
+def _read_parquet_dataset(
+    path: Path,
+    dataset_filter: DatasetFilter = DatasetFilter(),
+    columns: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    # Reading match IDs as a dictionary avoids hashing every string when the index is built.
+    # Filters are evaluated by the Parquet reader, which skips row groups that cannot match them.
+    table = pq.read_table(
+        path,
+        columns=columns,
+        filters=dataset_filter.to_arrow(),
+        read_dictionary=['match.id'],
+        use_pandas_metadata=True,
+    )
+    df = table.to_pandas()
+    _encode_match_ids(df)
+    raw_attrs = json.loads(table.schema.metadata.get(_parquet_attrs_key, b'{}'))
+    df.attrs = _parse_dataset_attrs(raw_attrs)
+    return df
+
+
+def _read_numpy_dataset(path: Path, dataset_filter: DatasetFilter, columns: Optional[List[str]]) -> pd.DataFrame:
+    # Columns are copy-on-write memory maps: processes reading the same dataset share its pages
+    # through the OS page cache, and modifications of a frame never reach the files.
+    # Files of columns that are neither projected nor filtered on are not opened, and a filtered
+    # frame copies only the matching rows.
+    with open(path / _numpy_meta_file_name) as file:
+        meta = json.load(file)
+    read_columns = _get_read_columns(dataset_filter, columns)
+    data = {}
+    for column in meta['columns']:
+        if read_columns is not None and column['name'] not in read_columns:
+            continue
+        values = np.load(path / (column['name'] + '.npy'), mmap_mode='c')
+        if column['categories'] is not None:
+            # Codes are written in the dtype of their categories, so they're wrapped as they are, unlike
+            # in from_codes, which validates them by reading the whole map.
+            values = pd.Categorical(values, dtype=pd.CategoricalDtype(column['categories']), fastpath=True)
+        data[column['name']] = values
+    levels = []
+    codes = []
+    for level in meta['index']:
+        if level['categorical']:
+            levels.append(pd.CategoricalIndex(level['values'], categories=level['values']))
+        else:
+            levels.append(pd.Index(level['values']))
+        codes.append(np.load(path / ('index.' + level['name'] + '.npy'), mmap_mode='c'))
+    index = pd.MultiIndex(
+        levels=levels,
+        codes=codes,
+        names=[level['name'] for level in meta['index']],
+        verify_integrity=False,
+    )
+    df = pd.DataFrame(data, index=index, copy=False)
+    df.attrs = _parse_dataset_attrs(meta['attrs'])
+    _encode_match_ids(df)
+    return _filter_dataset(df, dataset_filter, columns)
+
+
+def _get_partitioning(column_type: pa.DataType) -> ds.Partitioning:
+    schema = pa.schema([(column, column_type) for column in _partition_columns])
+    return ds.partitioning(schema, flavor='hive', dictionaries='infer' if pa.types.is_dictionary(column_type) else None)
+
+
+def _read_partitioned_dataset(path: Path, dataset_filter: DatasetFilter, columns: Optional[List[str]]) -> pd.DataFrame:
+    # Partitions are pruned by the league and season filters before any file is opened.
+    dataset = ds.dataset(path, format='parquet', partitioning=_get_partitioning(pa.dictionary(pa.int32(), pa.string())))
+    # Rows come in the order of the partition directories, so the ordering columns are read as well.
+    order_columns = [column for column in _dataset_order_columns if column not in _dataset_index_columns]
+    table = dataset.to_table(
+        columns=None if columns is None else list(dict.fromkeys([*_dataset_index_columns, *columns, *order_columns])),
+        filter=dataset_filter.to_arrow(),
+    )
+    df = table.to_pandas()
+    df.sort_values(_dataset_order_columns, kind='stable', inplace=True)
+    if columns is None:
+        # Partition columns are appended by pyarrow, the original column order is restored.
+        columns = [
+            column['name']
+            for column in dataset.schema.pandas_metadata['columns']
+            if column['name'] in df.columns
+        ]
+    df = df[columns]
+    with open(path / _partitioned_meta_file_name) as file:
+        df.attrs = _parse_dataset_attrs(json.load(file)['attrs'])
+    _encode_match_ids(df)
+    return df
+
+
+def _read_overlay_dataset(
+    path: Path,
+    kind: DatasetKind,
+    dataset_filter: DatasetFilter,
+    columns: Optional[List[str]],
+) -> pd.DataFrame:
+    # The overlay holds only the columns added to its base dataset and the positions of its rows in
+    # the base. Base columns are not copied if the overlay covers every row of the base in order.
+    schema = pq.read_schema(path)
+    meta = json.loads(schema.metadata[_parquet_overlay_key])
+    base_path = path.parent / meta['base']
+    if not base_path.exists():
+        raise FileNotFoundError(f'Base dataset "{meta["base"]}" of {path.absolute()} not found.')
+    columns = columns or meta['columns']
+    read_columns = _get_read_columns(dataset_filter, columns)
+    overlay_columns = [column for column in read_columns if column in schema.names] # type: ignore
+    base_columns = [column for column in read_columns if column not in schema.names] # type: ignore
+    overlay_df = pq.read_table(path, columns=[_overlay_position_column, *overlay_columns]).to_pandas()
+    # A base rewritten in place, even with as many rows, is told by its content hash. Overlays written
+    # before the hash was stored are checked by the length only.
+    base_df = _load_dataset(base_path, kind, DatasetFilter(), None if 'base_hash' in meta else base_columns)
+    is_base_changed = len(base_df) != meta['base_length']
+    if 'base_hash' in meta and not is_base_changed:
+        is_base_changed = _hash_dataset(_decode_match_ids(base_df)) != meta['base_hash']
+        base_df = base_df[base_columns]
+    if is_base_changed:
+        raise ValueError(f'Base dataset "{meta["base"]}" of {path.absolute()} has changed.')
+    positions = overlay_df.pop(_overlay_position_column).values
+    if not np.array_equal(positions, np.arange(len(base_df))):
+        base_df = base_df.iloc[positions]
+    overlay_df.index = base_df.index
+    df = pd.concat([base_df, overlay_df], axis=1, copy=False)
+    raw_attrs = json.loads(schema.metadata.get(_parquet_attrs_key, b'{}'))
+    df.attrs = _parse_dataset_attrs(raw_attrs)
+    return _filter_dataset(df, dataset_filter, columns)
+
+
+def _connect_catalog() -> sqlite3.Connection:
+    path = config.data_dir / 'datasets' / _catalog_file_name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(path)
+    connection.executescript(_catalog_schema)
+    return connection
+
+
+def _register_dataset(
+    df: pd.DataFrame,
+    path: Path,
+    format: DatasetFormat,
+    attrs: Dict[str, str],
+    model: Optional[Model],
+):
+    if path.is_dir():
+        size = sum(file_path.stat().st_size for file_path in path.rglob('*') if file_path.is_file())
+    else:
+        size = path.stat().st_size
+    if format == DatasetFormat.PARTITIONED:
+        # The data frame may hold only some partitions of the dataset.
+        played_at = _read_partitioned_dataset(path, DatasetFilter(), ['match.played_at'])['match.played_at']
+    else:
+        played_at = df['match.played_at']
+    row = {
+        'path': str(path.absolute()),
+        'dir': str(path.parent.absolute()),
+        'kind': path.parent.name,
+        'name': path.name[:-len(format.suffix)],
+        'format': format.value,
+        'created_at': datetime.now().isoformat(),
+        'length': len(played_at),
+        'played_from': None if played_at.isna().all() else played_at.min().isoformat(),
+        'played_to': None if played_at.isna().all() else played_at.max().isoformat(),
+        'size': size,
+        'attrs': json.dumps(attrs),
+        'source': df.attrs.get('source'),
+        'query': df.attrs.get('query'),
+        'model': model and model.default_name,
+    }
+    with closing(_connect_catalog()) as connection, connection:
+        connection.execute(
+            f'INSERT OR REPLACE INTO dataset ({", ".join(row)}) VALUES ({", ".join("?" * len(row))})',
+            tuple(row.values()),
+        )
+
+
+def _find_latest_dataset_path(dir: Path) -> Optional[Path]:
+    with closing(_connect_catalog()) as connection, connection:
+        while True:
+            row = connection.execute(
+                'SELECT path FROM dataset WHERE dir = ? ORDER BY created_at DESC LIMIT 1',
+                (str(dir.absolute()),),
+            ).fetchone()
+            if row is None:
+                return None
+            path = Path(row[0])
+            if path.exists():
+                return path
+            # Datasets deleted from the disk are forgotten on the way.
+            connection.execute('DELETE FROM dataset WHERE path = ?', row)
+
+
+def _find_named_dataset_path(name: str, dir: Optional[Path] = None) -> Optional[Path]:
+    with closing(_connect_catalog()) as connection:
+        if dir is None:
+            rows = connection.execute(
+                'SELECT path FROM dataset WHERE name = ? ORDER BY created_at DESC',
+                (name,),
+            ).fetchall()
+        else:
+            rows = connection.execute(
+                'SELECT path FROM dataset WHERE dir = ? AND name = ? ORDER BY created_at DESC',
+                (str(dir.absolute()), name),
+            ).fetchall()
+    return next((Path(path) for path, in rows if Path(path).exists()), None)
+
+
+def _find_dataset_path(dir: Path, name: Optional[str] = None) -> Path:
+    if name:
+        # Datasets saved in several formats share their content hash names, and the latest one is read.
+        if path := _find_named_dataset_path(name, dir):
+            return path
+        paths = [path for format in DatasetFormat if (path := dir / (name + format.suffix)).exists()]
+        if not paths:
+            raise FileNotFoundError(f'No dataset "{name}" found in {dir.absolute()}.')
+        return max(paths, key=os.path.getmtime)
+    if path := _find_latest_dataset_path(dir):
+        return path
+    # Datasets saved before the catalog was introduced are found by scanning the directory.
+    paths = [path for format in DatasetFormat for path in dir.glob('*' + format.suffix)]
+    if not paths:
+        raise FileNotFoundError(f'No datasets found in {dir.absolute()}.')
+    return max(paths, key=os.path.getctime)
+
+
+def search_datasets(
+    dir: Optional[Path] = None,
+    *,
+    source: Optional[str] = None,
+    model: Optional[Model | str] = None,
+) -> pd.DataFrame:
+    conditions = []
+    params = []
+    if dir is not None:
+        if not dir.is_absolute():
+            dir = config.data_dir / dir
+        conditions.append('dir = ?')
+        params.append(str(dir.absolute()))
+    if source is not None:
+        conditions.append('source = ?')
+        params.append(source)
+    if model is not None:
+        conditions.append('model = ?')
+        params.append(model if isinstance(model, str) else model.default_name)
+    query = 'SELECT * FROM dataset'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY created_at DESC'
+    with closing(_connect_catalog()) as connection:
+        df = pd.read_sql_query(query, connection, params=params, parse_dates=['created_at', 'played_from', 'played_to'])
+    df['attrs'] = df['attrs'].apply(json.loads)
+    return df.set_index('path')
+
+
+def _load_dataset(
+    path: Path,
+    kind: DatasetKind,
+    dataset_filter: DatasetFilter,
+    columns: Optional[List[str]],
+) -> pd.DataFrame:
+    match DatasetFormat(path.suffix[1:]):
+        case DatasetFormat.CSV:
+            df = _read_csv_dataset(path, kind, dataset_filter, columns)
+        case DatasetFormat.PARQUET:
+            df = _read_parquet_dataset(path, dataset_filter, columns)
+        case DatasetFormat.NUMPY:
+            df = _read_numpy_dataset(path, dataset_filter, columns)
+        case DatasetFormat.PARTITIONED:
+            df = _read_partitioned_dataset(path, dataset_filter, columns)
+        case DatasetFormat.OVERLAY:
+            df = _read_overlay_dataset(path, kind, dataset_filter, columns)
+    df.attrs['source'] = path.name[:-len(path.suffix)]
     logging.info(f'Loaded match dataset from {path.absolute()}.')
     return df
 
 
-def read_match_dataset(name: Optional[str] = None) -> pd.DataFrame:
+def read_dataset(
+    kind: DatasetKind,
+    dir: Path,
+    name: Optional[str] = None,
+) -> LazyDataset:
+    if not dir.is_absolute():
+        dir = config.data_dir / dir
+    path = _find_dataset_path(dir, name)
+    return LazyDataset(partial(_load_dataset, path, kind))
+
+
+def read_match_dataset(name: Optional[str] = None) -> LazyDataset:
     return read_dataset(DatasetKind.MATCH, Path('datasets', 'match'), name)
 
 
-def read_predicted_match_dataset(name: Optional[str] = None) -> pd.DataFrame:
+def read_predicted_match_dataset(name: Optional[str] = None) -> LazyDataset:
     return read_dataset(DatasetKind.PREDICTED_MATCH, Path('datasets', 'predicted_match'), name)
 
 
-def read_bet_match_dataset(name: Optional[str] = None) -> pd.DataFrame:
+def read_bet_match_dataset(name: Optional[str] = None) -> LazyDataset:
     return read_dataset(DatasetKind.BET_MATCH, Path('datasets', 'bet_match'), name)
 
 
+def _select_watermark(sql_session: SQLSession) -> Tuple[Any, ...]:
+    return tuple(sql_session.execute(sa.text(_watermark_query)).one())
+
+
+def _get_selection_cache_path(*key) -> Path:
+    cache_key = str(UUID(md5(repr(key).encode('utf-8')).hexdigest()))
+    return config.data_dir / 'cache' / 'selections' / (cache_key + DatasetFormat.PARQUET.suffix)
+
+
+def _cache_selection(df: pd.DataFrame, path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    attrs = {}
+    if df.attrs.get('loaded_at'):
+        attrs['loaded_at'] = df.attrs['loaded_at'].isoformat()
+    _write_parquet_dataset(_decode_match_ids(df), path.parent, path.stem, attrs)
+    # Evict the least recently used selections until the cache fits into its size limit.
+    cached_paths = sorted(path.parent.glob('*' + DatasetFormat.PARQUET.suffix), key=os.path.getmtime)
+    cache_size = sum(cached_path.stat().st_size for cached_path in cached_paths)
+    for cached_path in cached_paths[:-1]:
+        if cache_size <= config.selection_cache_size_mb * 2**20:
+            break
+        cache_size -= cached_path.stat().st_size
+        cached_path.unlink()
+        logging.debug(f'Evicted cached selection {cached_path.stem}.')
+
+
+def _format_selection_query(
+    dataset_filter: DatasetFilter,
+    columns: Optional[List[str]] = None,
+    loaded_after: Optional[datetime] = None,
+    query_template: str = _df_selection_query,
+) -> Tuple[str, Dict[str, Any]]:
+    query_params: Dict[str, Any] = {
+        'played_after': dataset_filter.played_after,
+        'played_before': dataset_filter.played_before,
+        'bookmakers': tuple(sorted(bookmaker.name for bookmaker in dataset_filter.bookmakers or Bookmaker)),
+    }
+    league_conditions = ''
+    if dataset_filter.leagues is not None:
+        league_conditions = _league_condition
+        query_params['leagues'] = tuple(sorted(dataset_filter.leagues))
+    tournament_conditions = ''
+    if dataset_filter.seasons is not None:
+        tournament_conditions = _tournament_condition
+        query_params['seasons'] = tuple(sorted(dataset_filter.seasons))
+    match_conditions = ''
+    if loaded_after is not None:
+        match_conditions = _loaded_match_condition
+        query_params['loaded_after'] = loaded_after
+    if columns is None:
+        selected_columns = '*'
+    else:
+        selected_columns = ', '.join(f'"{column}"' for column in [*_dataset_index_columns, *columns])
+    query = query_template.format(
+        columns=selected_columns,
+        match_conditions=match_conditions,
+        tournament_conditions=tournament_conditions,
+        league_conditions=league_conditions,
+    )
+    return query, query_params
+
+
+def _get_selection_column_dtypes(columns: Optional[List[str]] = None) -> Dict[str, str]:
+    return {
+        column: dtype
+        for column, dtype in _match_column_dtypes.items()
+        if columns is None or column in _dataset_index_columns or column in columns
+    }
+
+
+def _prepare_selection(df: pd.DataFrame):
+    # Enum names are decoded once per category instead of once per row.
+    if 'match.sport' in df:
+        df['match.sport'] = df['match.sport'].cat.rename_categories(lambda x: str(Sport.from_string(x)))
+    df['bookmaker'] = df['bookmaker'].cat.rename_categories(lambda x: str(Bookmaker.from_string(x)))
+    df.set_index(['match.id', 'bookmaker'], drop=True, inplace=True)
+    _encode_match_ids(df)
+
+
+def _merge_selections(base_df: pd.DataFrame, df: pd.DataFrame) -> pd.DataFrame:
+    # Rows of reselected matches replace the base ones, including matches that were reloaded to
+    # the database under new IDs.
+    base_df = base_df.drop(df.index.unique('match.id'), level='match.id', errors='ignore')
+    base_df = base_df.loc[
+        ~pd.MultiIndex.from_frame(base_df[_match_natural_key]).isin(
+            pd.MultiIndex.from_frame(df[_match_natural_key])
+        )
+    ]
+    dfs = [base_df.reset_index(), df.reset_index()]
+    for column, dtype in dfs[0].dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            categoricals = [df[column].values for df in dfs]
+            categories = pd.api.types.union_categoricals(categoricals).categories
+            for df in dfs:
+                df[column] = df[column].cat.set_categories(categories)
+    df = pd.concat(dfs, ignore_index=True)
+    df.sort_values(_dataset_order_columns, inplace=True)
+    df.set_index(['match.id', 'bookmaker'], drop=True, inplace=True)
+    return df
+
+
+def _describe_selection(db_url: str, dataset_filter: DatasetFilter, columns: Optional[List[str]]) -> str:
+    leagues, seasons, bookmakers, played_after, played_before = dataset_filter.key
+    description = {
+        'db': sa.engine.make_url(db_url).render_as_string(hide_password=True),
+        'leagues': leagues or None,
+        'seasons': seasons or None,
+        'bookmakers': bookmakers or None,
+        'played_after': played_after.isoformat(),
+        'played_before': played_before.isoformat(),
+        'columns': columns,
+    }
+    return json.dumps(description)
+
+
+def _select_match_ids(db_url: str, dataset_filter: DatasetFilter) -> np.ndarray:
+    query, query_params = _format_selection_query(dataset_filter, query_template=_match_id_selection_query)
+    match_ids = pd.read_sql_query(sql=query, con=get_engine(db_url), params=query_params, dtype={'match.id': 'str'})
+    return _intern_match_uuids(pd.Index(match_ids['match.id']))
+
+
+def _select_dataset(
+    db_url: str,
+    base: Optional[pd.DataFrame | LazyDataset],
+    cache: bool,
+    dataset_filter: DatasetFilter,
+    columns: Optional[List[str]],
+) -> pd.DataFrame:
+    with closing(SQLSession.from_url(db_url)) as sql_session:
+        watermark = _select_watermark(sql_session)
+    # Selections bounded within a day, e.g. by the current time, are hardly ever selected again.
+    cache = cache and base is None and all(
+        bound in (datetime.min, datetime.max) or bound.time() == time.min
+        for bound in (dataset_filter.played_after, dataset_filter.played_before)
+    )
+    if cache:
+        cache_path = _get_selection_cache_path(db_url, dataset_filter.key, columns, watermark)
+        if cache_path.exists():
+            os.utime(cache_path)
+            df = _read_parquet_dataset(cache_path)
+            logging.info(f'Loaded selected dataset from the cache {cache_path.stem}.')
+            df.attrs['query'] = _describe_selection(db_url, dataset_filter, columns)
+            return df
+    if isinstance(base, LazyDataset):
+        base = base.collect()
+    loaded_after = None
+    query_columns = columns
+    # Only the matches loaded after the base dataset or having odds loaded after it are reselected.
+    if base is not None and base.attrs.get('loaded_at'):
+        loaded_after = base.attrs['loaded_at']
+        if columns is not None:
+            query_columns = list(dict.fromkeys([*columns, *_match_natural_key]))
+    query, query_params = _format_selection_query(dataset_filter, query_columns, loaded_after)
+    df = pd.read_sql_query(
+        sql=query,
+        con=sql_session.bind,
+        params=query_params,
+        parse_dates=[column for column in ['match.played_at'] if query_columns is None or column in query_columns],
+        dtype=_get_selection_column_dtypes(query_columns), # type: ignore
+    )
+    _prepare_selection(df)
+    if loaded_after is not None:
+        logging.info(f'Selected {humanize_match_count(len(df))} loaded after the base dataset.')
+        # Matches deleted since the base dataset, e.g. rescheduled fixtures, leave no rows to reselect,
+        # so the base is checked against the matches still stored.
+        base = base.loc[base.index.get_level_values('match.id').isin(_select_match_ids(db_url, dataset_filter))]
+        # The base dataset may contain rows that do not pass the filter.
+        df = _filter_dataset(_merge_selections(base, df), dataset_filter, columns) # type: ignore
+    match_loaded_at, _, odds_loaded_at = watermark
+    df.attrs['loaded_at'] = max(filter(None, [match_loaded_at, odds_loaded_at]), default=None)
+    if cache and not config.dry:
+        _cache_selection(df, cache_path)
+    df.attrs['query'] = _describe_selection(db_url, dataset_filter, columns)
+    return df
+
+
 def select_dataset(
     db_url: Optional[str] = None,
     *,
     played_after: datetime = datetime.min,
     played_before: datetime = datetime.max,
     bookmakers: Set[Bookmaker] = set(Bookmaker),
-) -> pd.DataFrame:
-    sql_session = SQLSession.from_url(db_url or config.db_url)
-    query_params = {
-        'played_after': played_after,
-        'played_before': played_before,
-        'bookmakers': tuple(bookmaker.name for bookmaker in bookmakers),
-    }
-    df = pd.read_sql_query(
-        sql=_df_selection_query,
-        con=sql_session.bind,
-        params=query_params,
-        parse_dates=['match.played_at'],
-        dtype=_match_column_dtypes, # type: ignore
+    base: Optional[pd.DataFrame | LazyDataset] = None,
+    cache: bool = True,
+) -> LazyDataset:
+    dataset_filter = DatasetFilter(
+        bookmakers=frozenset(bookmakers),
+        played_after=played_after,
+        played_before=played_before,
     )
-    df.drop(columns=['odds.scan_rank'], inplace=True)
-    df['match.sport'] = df['match.sport'].apply(lambda x: str(Sport.from_string(x)))
-    df['bookmaker'] = df['bookmaker'].apply(lambda x: x and str(Bookmaker.from_string(x)))
-    df.set_index(['match.id', 'bookmaker'], drop=True, inplace=True)
-    return df
+    return LazyDataset(partial(_select_dataset, db_url or config.db_url, base, cache), dataset_filter)
+
+
+def select_dataset_chunks(
+    db_url: Optional[str] = None,
+    *,
+    played_after: datetime = datetime.min,
+    played_before: datetime = datetime.max,
+    bookmakers: Set[Bookmaker] = set(Bookmaker),
+    chunk_size: int = 100_000,
+) -> Iterator[pd.DataFrame]:
+    # Rows are fetched through a server-side cursor, so only one chunk is held in memory at a time.
+    # Categories of categorical columns may differ between chunks.
+    dataset_filter = DatasetFilter(
+        bookmakers=frozenset(bookmakers),
+        played_after=played_after,
+        played_before=played_before,
+    )
+    query, query_params = _format_selection_query(dataset_filter)
+    with get_engine(db_url).connect().execution_options(stream_results=True) as connection:
+        df_chunks = pd.read_sql_query(
+            sql=query,
+            con=connection,
+            params=query_params,
+            parse_dates=['match.played_at'],
+            dtype=_match_column_dtypes, # type: ignore
+            chunksize=chunk_size,
+        )
+        for df in df_chunks:
+            _prepare_selection(df)
+            yield df
+
+
+def explain_select_dataset(
+    db_url: Optional[str] = None,
+    *,
+    played_after: datetime = datetime.min,
+    played_before: datetime = datetime.max,
+    bookmakers: Set[Bookmaker] = set(Bookmaker),
+) -> str:
+    dataset_filter = DatasetFilter(
+        bookmakers=frozenset(bookmakers),
+        played_after=played_after,
+        played_before=played_before,
+    )
+    query, query_params = _format_selection_query(dataset_filter)
+    with closing(SQLSession.from_url(db_url or config.db_url)) as sql_session:
+        return sql_session.explain(query, query_params)
+
+
+def _write_csv_dataset(
+    df: pd.DataFrame,
+    dir: Path,
+    name: Optional[str],
+    attrs: Dict[str, str],
+    chunk_size: int = 100_000,
+) -> Path:
+    # The dataset is written chunk by chunk to a temporary file, and the content hash that names
+    # the file is updated on the way, so peak memory depends on the chunk size and not on the
+    # dataset size.
+    columns = ['match.id', *df.columns[:10], 'bookmaker', *df.columns[10:]]
+    df_hash = md5()
+    with tempfile.NamedTemporaryFile('w', dir=dir, suffix='.tmp', delete=False) as file:
+        try:
+            file.write(f'# ALPHABETTER DATASET\n')
+            for key, value in attrs.items():
+                file.write(f'# {key}: {value}\n')
+            file.write('\n')
+            for start in range(0, max(len(df), 1), chunk_size):
+                chunk_df = df.iloc[start:start + chunk_size].reset_index()
+                chunk_df['match.id'] = chunk_df['match.id'].astype(str)
+                chunk_csv = chunk_df[columns].to_csv(index=False, header=(start == 0))
+                df_hash.update(chunk_csv.encode('utf-8'))
+                file.write(chunk_csv)
+        except BaseException:
+            os.remove(file.name)
+            raise
+    if not name:
+        name = str(UUID(df_hash.hexdigest()))
+    path = dir / (name + DatasetFormat.CSV.suffix)
+    os.replace(file.name, path)
+    return path
 
 
-def save_dataset(df: pd.DataFrame, /, dir: Path, name: Optional[str] = None) -> Optional[Path]:
+def _hash_dataset(df: pd.DataFrame) -> str:
+    df_hash = pd.util.hash_pandas_object(df).values.tobytes()
+    return str(UUID(md5(df_hash).hexdigest()))
+
+
+def _write_parquet_dataset(df: pd.DataFrame, dir: Path, name: Optional[str], attrs: Dict[str, str]) -> Path:
+    name = name or _hash_dataset(df)
+    path = dir / (name + DatasetFormat.PARQUET.suffix)
+    table = pa.Table.from_pandas(df)
+    metadata = {**table.schema.metadata, _parquet_attrs_key: json.dumps(attrs).encode('utf-8')}
+    with tempfile.NamedTemporaryFile('wb', dir=dir, suffix='.tmp', delete=False) as file:
+        try:
+            pq.write_table(table.replace_schema_metadata(metadata), file)
+        except BaseException:
+            os.remove(file.name)
+            raise
+    os.replace(file.name, path)
+    return path
+
+
+def _write_numpy_dataset(df: pd.DataFrame, dir: Path, name: Optional[str], attrs: Dict[str, str]) -> Path:
+    name = name or _hash_dataset(df)
+    path = dir / (name + DatasetFormat.NUMPY.suffix)
+    path.mkdir(exist_ok=True)
+    meta = {'attrs': attrs, 'columns': [], 'index': []}
+    for column, series in df.items():
+        if series.dtype == object:
+            series = series.astype('category')
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            values = series.cat.codes.values
+            categories = series.cat.categories.tolist()
+        else:
+            values = series.values
+            categories = None
+        np.save(path / (column + '.npy'), values)
+        meta['columns'].append({'name': column, 'categories': categories})
+    for level, level_codes in zip(df.index.levels, df.index.codes):
+        np.save(path / ('index.' + level.name + '.npy'), level_codes)
+        meta['index'].append({
+            'name': level.name,
+            'values': level.astype(str).tolist(),
+            'categorical': isinstance(level, pd.CategoricalIndex),
+        })
+    with open(path / _numpy_meta_file_name, 'w') as file:
+        json.dump(meta, file)
+    return path
+
+
+def _write_partitioned_dataset(df: pd.DataFrame, dir: Path, name: Optional[str], attrs: Dict[str, str]) -> Path:
+    name = name or _hash_dataset(df)
+    path = dir / (name + DatasetFormat.PARTITIONED.suffix)
+    path.mkdir(exist_ok=True)
+    table = pa.Table.from_pandas(df)
+    for column in _partition_columns:
+        table = table.set_column(table.schema.get_field_index(column), column, table[column].cast(pa.string()))
+    # Only the partitions present in the data frame are replaced, so adding a season to a dataset
+    # writes a single partition and leaves the rest of it untouched.
+    ds.write_dataset(
+        table,
+        path,
+        format='parquet',
+        partitioning=_get_partitioning(pa.string()),
+        existing_data_behavior='delete_matching',
+    )
+    meta_path = path / _partitioned_meta_file_name
+    meta = {'attrs': {}}
+    if meta_path.exists():
+        with open(meta_path) as file:
+            meta = json.load(file)
+    # The match frequency of a partial write does not describe the whole dataset.
+    meta['attrs'].pop('match.per_day', None)
+    loaded_at = max(filter(None, [meta['attrs'].get('loaded_at'), attrs.get('loaded_at')]), default=None)
+    meta['attrs'].update({key: value for key, value in attrs.items() if key != 'match.per_day'})
+    if loaded_at:
+        meta['attrs']['loaded_at'] = loaded_at
+    with open(meta_path, 'w') as file:
+        json.dump(meta, file)
+    return path
+
+
+def _get_overlay(df: pd.DataFrame, base_path: Path) -> Optional[Tuple[pd.DataFrame, Dict[str, Any]]]:
+    base_df = _load_dataset(base_path, DatasetKind.MATCH, DatasetFilter(), None)
+    meta = {
+        'base_length': len(base_df),
+        # Interned match IDs differ between processes, so the base is hashed by its UUIDs.
+        'base_hash': _hash_dataset(_decode_match_ids(base_df)),
+        'columns': df.columns.tolist(),
+    }
+    if df.index.equals(base_df.index):
+        positions = np.arange(len(base_df))
+    else:
+        positions = base_df.index.get_indexer(df.index)
+        if (positions == -1).any():
+            return None
+        base_df = base_df.iloc[positions]
+    overlay_columns = [
+        column
+        for column in df.columns
+        if column not in base_df.columns or not df[column].equals(base_df[column])
+    ]
+    overlay_df = df[overlay_columns].reset_index(drop=True)
+    overlay_df.insert(0, _overlay_position_column, positions.astype('i4'))
+    return overlay_df, meta
+
+
+def _write_overlay_dataset(
+    df: pd.DataFrame,
+    dir: Path,
+    name: Optional[str],
+    attrs: Dict[str, str],
+    base_path: Path,
+    overlay: Tuple[pd.DataFrame, Dict[str, Any]],
+) -> Path:
+    name = name or _hash_dataset(df)
+    path = dir / (name + DatasetFormat.OVERLAY.suffix)
+    overlay_df, meta = overlay
+    meta = {**meta, 'base': os.path.relpath(base_path, dir)}
+    table = pa.Table.from_pandas(overlay_df, preserve_index=False)
+    metadata = {
+        **table.schema.metadata,
+        _parquet_attrs_key: json.dumps(attrs).encode('utf-8'),
+        _parquet_overlay_key: json.dumps(meta).encode('utf-8'),
+    }
+    with tempfile.NamedTemporaryFile('wb', dir=dir, suffix='.tmp', delete=False) as file:
+        try:
+            pq.write_table(table.replace_schema_metadata(metadata), file)
+        except BaseException:
+            os.remove(file.name)
+            raise
+    os.replace(file.name, path)
+    return path
+
+
+def save_dataset(
+    df: pd.DataFrame | LazyDataset,
+    /,
+    dir: Path,
+    name: Optional[str] = None,
+    format: Optional[DatasetFormat] = None,
+    model: Optional[Model] = None,
+) -> Optional[Path]:
     if config.dry:
         return None
+    if isinstance(df, LazyDataset):
+        df = df.collect()
+    # Overlays are resolved before the match IDs are decoded, so the frame and its base share them.
+    base_path = None
+    overlay = None
+    if format == DatasetFormat.OVERLAY:
+        if df.attrs.get('source'):
+            base_path = _find_named_dataset_path(df.attrs['source'])
+        if base_path is not None:
+            overlay = _get_overlay(df, base_path)
+        if overlay is None:
+            logging.warning('No base dataset with all the rows is found, the dataset is saved as a whole.')
+            format = None
+    df = _decode_match_ids(df)
     if not dir.is_absolute():
         dir = config.data_dir / dir
-    df = df.copy()
-    df.insert(10, 'bookmaker', df.index.get_level_values('bookmaker'))
-    df.insert(0, 'match.id', df.index.get_level_values('match.id').astype(str))
-    df.reset_index(drop=True, inplace=True)
-    df_csv = df.to_csv(index=False)
-    if not name:
-        name = str(UUID(md5(df_csv.encode('utf-8')).hexdigest()))
-    path = dir / (name + '.csv')
+    format = format or DatasetFormat(config.dataset_format)
     attrs = {
         'version': config.version,
         'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
         'representativeness': str(round(df.attrs.get("representativeness", 1.0), 4)),
         'match.per_day': str(round(df.match.per_day(), 4)),
     }
-    with open(path, 'w') as file:
-        file.write(f'# ALPHABETTER DATASET\n')
-        for key, value in attrs.items():
-            file.write(f'# {key}: {value}\n')
-        file.write('\n')
-        file.write(df_csv)
+    if df.attrs.get('loaded_at'):
+        attrs['loaded_at'] = df.attrs['loaded_at'].isoformat()
+    match format:
+        case DatasetFormat.CSV:
+            path = _write_csv_dataset(df, dir, name, attrs)
+        case DatasetFormat.PARQUET:
+            path = _write_parquet_dataset(df, dir, name, attrs)
+        case DatasetFormat.NUMPY:
+            path = _write_numpy_dataset(df, dir, name, attrs)
+        case DatasetFormat.PARTITIONED:
+            path = _write_partitioned_dataset(df, dir, name, attrs)
+        case DatasetFormat.OVERLAY:
+            path = _write_overlay_dataset(df, dir, name, attrs, base_path, overlay) # type: ignore
+    _register_dataset(df, path, format, attrs, model)
     return path
 
 
-def save_match_dataset(df: pd.DataFrame, /, name: Optional[str] = None) -> Optional[Path]:
-    return save_dataset(df, Path('datasets', 'match'), name)
+def save_match_dataset(
+    df: pd.DataFrame,
+    /,
+    name: Optional[str] = None,
+    format: Optional[DatasetFormat] = None,
+) -> Optional[Path]:
+    return save_dataset(df, Path('datasets', 'match'), name, format)
 
 
-def save_predicted_match_dataset(df: pd.DataFrame, /, name: Optional[str] = None) -> Optional[Path]:
-    return save_dataset(df, Path('datasets', 'predicted_match'), name)
+def save_predicted_match_dataset(
+    df: pd.DataFrame,
+    /,
+    name: Optional[str] = None,
+    format: Optional[DatasetFormat] = None,
+    model: Optional[Model] = None,
+) -> Optional[Path]:
+    return save_dataset(df, Path('datasets', 'predicted_match'), name, format or DatasetFormat.OVERLAY, model)
 
 
-def save_bet_match_dataset(df: pd.DataFrame, /, name: Optional[str] = None) -> Optional[Path]:
-    return save_dataset(df, Path('datasets', 'bet_match'), name)
+def save_bet_match_dataset(
+    df: pd.DataFrame,
+    /,
+    name: Optional[str] = None,
+    format: Optional[DatasetFormat] = None,
+    model: Optional[Model] = None,
+) -> Optional[Path]:
+    return save_dataset(df, Path('datasets', 'bet_match'), name, format or DatasetFormat.OVERLAY, model)
 
 
 def describe_dataset(df: pd.DataFrame, /) -> str:
@@ -1,3 +1,4 @@
 ''' SQL facilities. '''
 
-from alphabetter.sql.session import SQLSession
+from alphabetter.sql.session import SQLSession, AsyncSQLSession, get_engine
+from alphabetter.sql.resolution import MatchResolver, MatchInfo
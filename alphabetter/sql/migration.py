@@ -0,0 +1,69 @@
+''' In-place upgrades of databases created by older versions of the schema. '''
+
+import sqlalchemy as sa
+import alphabetter.sql.types
+import logging
+
+from alphabetter.sql.schema import sql_schema, odds_table
+from alphabetter.sql.partitions import is_odds_partitioned, create_odds_partitions
+
+
+logger = logging.getLogger(__name__)
+
+
+def _get_stale_uuid_columns(inspector: sa.engine.Inspector, table: sa.Table) -> list[sa.Column]:
+    db_column_types = {column['name']: column['type'] for column in inspector.get_columns(table.name)}
+    return [
+        column for column in table.columns
+            if isinstance(column.type, alphabetter.sql.types.UUID)
+            and column.name in db_column_types
+            and db_column_types[column.name].__visit_name__.upper() != 'UUID'
+    ]
+
+
+def migrate_uuid_keys(connection: sa.engine.Connection):
+    ''' Converts VARCHAR(36) keys of an existing database to the native UUID type. '''
+    inspector = sa.inspect(connection)
+    tables = [table for table in sql_schema.sorted_tables if inspector.has_table(table.name)]
+    stale_columns = {table: _get_stale_uuid_columns(inspector, table) for table in tables}
+    if not any(stale_columns.values()):
+        return
+    # Foreign keys can't span columns of different types, so they are dropped for the conversion
+    # and recreated from the schema afterwards.
+    for table in tables:
+        for foreign_key in inspector.get_foreign_keys(table.name):
+            connection.execute(sa.text(f'ALTER TABLE "{table.name}" DROP CONSTRAINT "{foreign_key["name"]}"'))
+    for table, columns in stale_columns.items():
+        for column in columns:
+            connection.execute(sa.text(
+                f'ALTER TABLE "{table.name}" ALTER COLUMN "{column.name}" TYPE UUID USING "{column.name}"::UUID'
+            ))
+            logger.info(f'Converted {table.name}.{column.name} to UUID.')
+    for table in tables:
+        for foreign_key in table.foreign_key_constraints:
+            connection.execute(sa.schema.AddConstraint(foreign_key))
+
+
+def partition_odds(connection: sa.engine.Connection):
+    ''' Makes the odds table partitioned by month, moving the scans of an existing unpartitioned one. '''
+    odds_table.dialect_options['postgresql']['partition_by'] = 'RANGE (scanned_at)'
+    if not sa.inspect(connection).has_table('odds') or is_odds_partitioned(connection):
+        return
+    # Names of indexes are unique across the tables, so the old ones must go first.
+    connection.execute(sa.text('ALTER TABLE odds RENAME TO odds_unpartitioned'))
+    connection.execute(sa.text('ALTER TABLE odds_unpartitioned RENAME CONSTRAINT odds_pkey TO odds_unpartitioned_pkey'))
+    for index in odds_table.indexes:
+        connection.execute(sa.text(f'DROP INDEX IF EXISTS "{index.name}"'))
+    # The bookmaker type is left by the renamed table.
+    odds_table.create(connection, checkfirst=True)
+    scanned_from, scanned_to = connection.execute(
+        sa.text('SELECT MIN(scanned_at), MAX(scanned_at) FROM odds_unpartitioned')
+    ).one()
+    if scanned_from is not None:
+        create_odds_partitions(connection, scanned_from, scanned_to)
+    column_list = ', '.join(f'"{column.name}"' for column in odds_table.columns)
+    connection.execute(sa.text(
+        f'INSERT INTO odds ({column_list}) SELECT {column_list} FROM odds_unpartitioned'
+    ))
+    connection.execute(sa.text('DROP TABLE odds_unpartitioned'))
+    logger.info('Partitioned the odds.')
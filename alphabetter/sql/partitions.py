@@ -0,0 +1,135 @@
+''' Monthly range partitions of the odds table by the scanning time. '''
+
+import sqlalchemy as sa
+import logging
+
+from datetime import datetime
+from enum import Enum
+from typing import Dict, List
+
+
+logger = logging.getLogger(__name__)
+
+_partition_name_format = 'odds_%Y_%m'
+
+_odds_partition_query = '''
+    SELECT child.relname
+    FROM pg_inherits
+    JOIN pg_class child
+        ON child.oid = pg_inherits.inhrelid
+    WHERE pg_inherits.inhparent = 'odds'::regclass
+    '''
+
+_foreign_key_query = '''
+    SELECT conname
+    FROM pg_constraint
+    WHERE conrelid = to_regclass(:name) AND contype = 'f'
+    '''
+
+# Only the latest pre-match scan per match and bookmaker is kept, which is the one datasets are
+# selected with.
+_downsampled_partition_insert_query = '''
+    INSERT INTO {downsampled_name}
+    SELECT DISTINCT ON (odds.match_id, odds.bookmaker) odds.*
+    FROM {name} odds
+    JOIN match
+        ON odds.match_id = match.id
+    WHERE odds.scanned_at < match.played_at
+    ORDER BY odds.match_id, odds.bookmaker, odds.scanned_at DESC
+    '''
+
+
+class RetentionAction(Enum):
+    DETACH = 'detach'
+    DROP = 'drop'
+    DOWNSAMPLE = 'downsample'
+
+    def __str__(self):
+        return self.value
+
+
+def _get_month(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1)
+
+
+def _get_next_month(month: datetime) -> datetime:
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _get_partition_bounds(month: datetime) -> str:
+    return f'FOR VALUES FROM (\'{month:%Y-%m-%d}\') TO (\'{_get_next_month(month):%Y-%m-%d}\')'
+
+
+def is_odds_partitioned(connection: sa.engine.Connection) -> bool:
+    if connection.dialect.name != 'postgresql':
+        return False
+    return connection.execute(sa.text(
+        'SELECT EXISTS (SELECT FROM pg_partitioned_table WHERE partrelid = to_regclass(\'odds\'))'
+    )).scalar()
+
+
+def get_odds_partitions(connection: sa.engine.Connection) -> Dict[datetime, str]:
+    partitions = {}
+    for (name,) in connection.execute(sa.text(_odds_partition_query)):
+        try:
+            partitions[datetime.strptime(name, _partition_name_format)] = name
+        except ValueError:
+            continue
+    return partitions
+
+
+def create_odds_partitions(connection: sa.engine.Connection, scanned_from: datetime, scanned_to: datetime):
+    ''' Creates the missing partitions of the odds scanned in the given period. '''
+    month = _get_month(scanned_from)
+    while month <= scanned_to:
+        connection.execute(sa.text(
+            f'CREATE TABLE IF NOT EXISTS {month:{_partition_name_format}} PARTITION OF odds '
+            f'{_get_partition_bounds(month)}'
+        ))
+        month = _get_next_month(month)
+
+
+def retire_odds_partitions(
+    connection: sa.engine.Connection,
+    scanned_before: datetime,
+    action: RetentionAction,
+) -> List[str]:
+    ''' Applies the retention action to the partitions of the odds scanned before the given time. '''
+    retired_names = []
+    for month, name in sorted(get_odds_partitions(connection).items()):
+        # Partitions are retired only as a whole.
+        if _get_next_month(month) > scanned_before:
+            break
+        match action:
+            case RetentionAction.DETACH:
+                # A detached partition is renamed, so that the month can be partitioned again.
+                connection.execute(sa.text(f'ALTER TABLE odds DETACH PARTITION {name}'))
+                connection.execute(sa.text(f'ALTER TABLE {name} RENAME TO {name}_detached'))
+                # Foreign keys kept by the partition would block deleting its matches.
+                foreign_key_names = connection.execute(
+                    sa.text(_foreign_key_query),
+                    {'name': f'{name}_detached'},
+                ).scalars().all()
+                for foreign_key_name in foreign_key_names:
+                    connection.execute(sa.text(f'ALTER TABLE {name}_detached DROP CONSTRAINT "{foreign_key_name}"'))
+            case RetentionAction.DROP:
+                connection.execute(sa.text(f'DROP TABLE {name}'))
+            case RetentionAction.DOWNSAMPLE:
+                downsampled_name = f'{name}_downsampled'
+                connection.execute(sa.text(
+                    f'CREATE TABLE {downsampled_name} (LIKE odds INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+                ))
+                connection.execute(sa.text(
+                    _downsampled_partition_insert_query.format(name=name, downsampled_name=downsampled_name)
+                ))
+                # Indexes and foreign keys of the parent are added to the partition when it's attached.
+                connection.execute(sa.text(f'DROP TABLE {name}'))
+                connection.execute(sa.text(f'ALTER TABLE {downsampled_name} RENAME TO {name}'))
+                connection.execute(sa.text(
+                    f'ALTER TABLE odds ATTACH PARTITION {name} {_get_partition_bounds(month)}'
+                ))
+            case _:
+                raise ValueError(f'Invalid retention action "{action}".')
+        logger.info(f'Retired the odds partition {name} ({action}).')
+        retired_names.append(name)
+    return retired_names
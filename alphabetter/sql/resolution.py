@@ -0,0 +1,381 @@
+''' Resolution of scraped matches to the stored ones. '''
+
+import sqlalchemy.orm
+import sqlalchemy as sa
+import alphabetter.sql.types
+import numpy as np
+import bisect
+import logging
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from alphabetter.core.model import Sport, Country, Match, Tournament, League
+from alphabetter.core.similarity import TeamNameSimilarity
+from scipy.optimize import linear_sum_assignment
+from typing import Optional, Iterable, Sequence, Dict, List, Tuple, Any
+from uuid import UUID
+
+
+logger = logging.getLogger(__name__)
+
+# Kickoff times break ties between candidates with similar team names in batch resolution: a stored
+# match played at the edge of the time window scores this much less.
+_played_at_weight = 0.5
+
+# Cost of assigning a scraped match to a stored one it can't be, e.g. played on another day.
+_invalid_assignment_cost = 1e6
+
+# A scraped match is assigned only stored matches costing at most this much more than its best
+# candidate, as a duplicate scrape would otherwise be pushed onto another match.
+_assignment_cost_margin = 0.05
+
+_team_alias_select_query = '''
+    SELECT league_name, name, team_id
+    FROM team_alias
+    WHERE source = :source AND sport = :sport
+    '''
+
+
+def query_matches(
+    sql_session: sqlalchemy.orm.Session,
+    sport: Sport,
+    played_from: datetime,
+    played_to: datetime,
+    league_names: Optional[Iterable[str]] = None,
+) -> sqlalchemy.orm.Query:
+    ''' Matches played in the given period with the names of their leagues and eagerly loaded teams. '''
+    query = (sql_session.query(Match, League.name)
+        .join(Match.tournament)
+        .join(Tournament.league)
+        .filter(
+            League.sport == sport,
+            # A plain range over played_at, unlike casting it to a date, is served by its index.
+            Match.played_at >= played_from,
+            Match.played_at <= played_to,
+        )
+        .options(
+            sqlalchemy.orm.joinedload(Match.home_team),
+            sqlalchemy.orm.joinedload(Match.away_team),
+        )
+    )
+    if league_names is not None:
+        query = query.filter(League.name.in_(list(league_names)))
+    return query
+
+
+@dataclass(frozen=True)
+class MatchInfo:
+    ''' Scraped match to be resolved. Match infos of the line4bet client can be resolved as well. '''
+    played_at: datetime
+    home_team: str
+    away_team: str
+
+
+@dataclass(frozen=True)
+class _StoredMatch:
+    played_at: datetime
+    home_team_id: UUID
+    home_team_country: Country
+    home_team_name: str
+    away_team_id: UUID
+    away_team_country: Country
+    away_team_name: str
+    match: Match
+
+
+class MatchResolver:
+    '''
+    Index of the matches of a sport played in a period, answering lookups without queries.
+
+    Attributes the lookups need are copied from the matches when they're loaded, so that expired
+    instances aren't reloaded, and the resolver can be used outside the thread of its session.
+
+    Given the source of scraped names, the resolver resolves the names learned from the source
+    exactly, and learns the names of teams matched with at least the alias precision.
+    '''
+
+    def __init__(
+        self,
+        sql_session: sqlalchemy.orm.Session,
+        sport: Sport,
+        played_from: datetime,
+        played_to: datetime,
+        league_names: Optional[Iterable[str]] = None,
+        source: Optional[str] = None,
+        alias_precision: float = 0.8,
+    ):
+        self.sport = sport
+        self.played_from = played_from
+        self.played_to = played_to
+        self.source = source
+        self.alias_precision = alias_precision
+        stored_matches: Dict[str, List[_StoredMatch]] = {}
+        for match, league_name in query_matches(sql_session, sport, played_from, played_to, league_names):
+            stored_matches.setdefault(league_name, []).append(_StoredMatch(
+                played_at=match.played_at,
+                home_team_id=match.home_team.id,
+                home_team_country=match.home_team.country,
+                home_team_name=match.home_team.name,
+                away_team_id=match.away_team.id,
+                away_team_country=match.away_team.country,
+                away_team_name=match.away_team.name,
+                match=match,
+            ))
+        self._team_aliases: Dict[Tuple[str, str], UUID] = {}
+        self._learned_team_aliases: List[Dict[str, Any]] = []
+        if source is not None:
+            team_alias_rows = sql_session.execute(
+                sa.text(_team_alias_select_query).bindparams(
+                    sa.bindparam('sport', type_=sa.Enum(Sport)),
+                ).columns(team_id=alphabetter.sql.types.UUID()),
+                {'source': source, 'sport': sport},
+            )
+            for league_name, name, team_id in team_alias_rows:
+                self._team_aliases[(league_name, name)] = team_id
+        # Matches of each league are sorted by time, so that a time window is found by bisection.
+        self._stored_matches = {}
+        self._played_ats = {}
+        # Team names are scored against all the teams of a league at once, and the scores of a match
+        # are picked by the indices of its teams.
+        self._team_name_similarities = {}
+        self._home_team_indices = {}
+        self._away_team_indices = {}
+        self._home_team_ids = {}
+        self._away_team_ids = {}
+        for league_name, league_stored_matches in stored_matches.items():
+            league_stored_matches.sort(key=lambda stored_match: stored_match.played_at)
+            self._stored_matches[league_name] = league_stored_matches
+            self._played_ats[league_name] = [stored_match.played_at for stored_match in league_stored_matches]
+            team_name_similarity = TeamNameSimilarity(
+                team_name
+                for stored_match in league_stored_matches
+                for team_name in (stored_match.home_team_name, stored_match.away_team_name)
+            )
+            self._team_name_similarities[league_name] = team_name_similarity
+            self._home_team_indices[league_name] = np.array([
+                team_name_similarity.get_team_index(stored_match.home_team_name)
+                for stored_match in league_stored_matches
+            ], dtype=int)
+            self._away_team_indices[league_name] = np.array([
+                team_name_similarity.get_team_index(stored_match.away_team_name)
+                for stored_match in league_stored_matches
+            ], dtype=int)
+            self._home_team_ids[league_name] = np.array(
+                [stored_match.home_team_id for stored_match in league_stored_matches],
+                dtype=object,
+            )
+            self._away_team_ids[league_name] = np.array(
+                [stored_match.away_team_id for stored_match in league_stored_matches],
+                dtype=object,
+            )
+        logger.debug(
+            f'Indexed {sum(map(len, stored_matches.values()))} {sport:_} matches '
+            f'played from {played_from:%b %d, %Y} to {played_to:%b %d, %Y}.'
+        )
+
+    def _covers(self, played_from: datetime, played_to: datetime) -> bool:
+        return self.played_from <= played_from and played_to <= self.played_to
+
+    def _get_window(self, league_name: str, played_from: datetime, played_to: datetime) -> slice:
+        if not self._covers(played_from, played_to):
+            raise ValueError(
+                f'The period from {played_from} to {played_to} isn\'t covered by the resolver '
+                f'of matches played from {self.played_from} to {self.played_to}.'
+            )
+        played_ats = self._played_ats.get(league_name, [])
+        return slice(bisect.bisect_left(played_ats, played_from), bisect.bisect_right(played_ats, played_to))
+
+    def get_matches(self, league_name: str, played_from: datetime, played_to: datetime) -> List[Match]:
+        window = self._get_window(league_name, played_from, played_to)
+        return [stored_match.match for stored_match in self._stored_matches.get(league_name, [])[window]]
+
+    def _get_team_name_similarities(
+        self,
+        league_name: str,
+        scraped_team_name: str,
+        team_ids: np.ndarray,
+        team_indices: np.ndarray,
+    ) -> np.ndarray:
+        team_id = self._team_aliases.get((league_name, scraped_team_name))
+        if team_id is not None:
+            return (team_ids == team_id).astype(float)
+        return self._team_name_similarities[league_name].get_similarities(scraped_team_name)[team_indices]
+
+    def _learn_team_alias(self, league_name: str, scraped_team_name: str, team_id: UUID, similarity: float):
+        if self.source is None or similarity < self.alias_precision:
+            return
+        if (league_name, scraped_team_name) in self._team_aliases:
+            return
+        self._team_aliases[(league_name, scraped_team_name)] = team_id
+        self._learned_team_aliases.append({
+            'source': self.source,
+            'sport': self.sport,
+            'league_name': league_name,
+            'name': scraped_team_name,
+            'team_id': team_id,
+            'similarity': float(similarity),
+        })
+
+    def pop_learned_team_aliases(self) -> List[Dict[str, Any]]:
+        ''' Team aliases learned since the last call, as rows of the team alias table. '''
+        learned_team_aliases = self._learned_team_aliases
+        self._learned_team_aliases = []
+        return learned_team_aliases
+
+    def find_match(
+        self,
+        league_name: str,
+        played_at: datetime,
+        home_team_name: str,
+        away_team_name: str,
+        home_team_country: Optional[Country] = None,
+        away_team_country: Optional[Country] = None,
+        played_at_precision: timedelta = timedelta(days=1),
+        team_name_precision: float = 0.5,
+    ) -> Optional[Match]:
+        # Candidates of a match played outside the period aren't indexed. Those of a match played near
+        # its bounds are looked up only within it.
+        if not self._covers(played_at, played_at):
+            return None
+        window = self._get_window(
+            league_name,
+            max(played_at - played_at_precision, self.played_from),
+            min(played_at + played_at_precision, self.played_to),
+        )
+        stored_matches = self._stored_matches.get(league_name, [])[window]
+        if not stored_matches:
+            return None
+        home_team_name_similarities = self._get_team_name_similarities(
+            league_name,
+            home_team_name,
+            self._home_team_ids[league_name][window],
+            self._home_team_indices[league_name][window],
+        )
+        away_team_name_similarities = self._get_team_name_similarities(
+            league_name,
+            away_team_name,
+            self._away_team_ids[league_name][window],
+            self._away_team_indices[league_name][window],
+        )
+        team_name_similarities = (home_team_name_similarities**2 + away_team_name_similarities**2) ** 0.5
+        best_index = None
+        best_team_name_similarity = None
+        for i, (stored_match, team_name_similarity) in enumerate(zip(stored_matches, team_name_similarities)):
+            if home_team_country and stored_match.home_team_country != home_team_country:
+                continue
+            if away_team_country and stored_match.away_team_country != away_team_country:
+                continue
+            if team_name_similarity < team_name_precision:
+                continue
+            if best_team_name_similarity is None or team_name_similarity > best_team_name_similarity:
+                best_index = i
+                best_team_name_similarity = team_name_similarity
+        if best_index is None:
+            return None
+        best_stored_match = stored_matches[best_index]
+        self._learn_team_alias(
+            league_name,
+            home_team_name,
+            best_stored_match.home_team_id,
+            home_team_name_similarities[best_index],
+        )
+        self._learn_team_alias(
+            league_name,
+            away_team_name,
+            best_stored_match.away_team_id,
+            away_team_name_similarities[best_index],
+        )
+        return best_stored_match.match
+
+    def find_matches(
+        self,
+        league_name: str,
+        match_infos: Sequence[MatchInfo],
+        played_at_precision: timedelta = timedelta(days=1),
+        team_name_precision: float = 0.5,
+    ) -> List[Optional[Match]]:
+        '''
+        Resolves scraped matches of a league at once, so that no two of them are resolved to the same
+        stored match.
+
+        Scraped matches are assigned to stored ones maximizing the total similarity of team names,
+        less a penalty for the distance in time. Matches without a candidate as similar as
+        the team name precision within the time precision, played outside the period of the resolver,
+        or left only with candidates much worse than their best ones, e.g. duplicates, are resolved to None.
+        '''
+        matches: List[Optional[Match]] = [None] * len(match_infos)
+        # Candidates of matches played outside the period aren't indexed, and those of matches played
+        # near its bounds are looked up only within it. Repeated scrapes of a match are resolved once.
+        indices = []
+        scraped_match_keys = set()
+        for i, match_info in enumerate(match_infos):
+            scraped_match_key = (match_info.played_at, match_info.home_team, match_info.away_team)
+            if scraped_match_key in scraped_match_keys:
+                continue
+            if not self._covers(match_info.played_at, match_info.played_at):
+                continue
+            scraped_match_keys.add(scraped_match_key)
+            indices.append(i)
+        if not indices:
+            return matches
+        match_infos = [match_infos[i] for i in indices]
+        window = self._get_window(
+            league_name,
+            max(min(match_info.played_at for match_info in match_infos) - played_at_precision, self.played_from),
+            min(max(match_info.played_at for match_info in match_infos) + played_at_precision, self.played_to),
+        )
+        stored_matches = self._stored_matches.get(league_name, [])[window]
+        if not stored_matches:
+            return matches
+        home_team_name_similarities = np.stack([
+            self._get_team_name_similarities(
+                league_name,
+                match_info.home_team,
+                self._home_team_ids[league_name][window],
+                self._home_team_indices[league_name][window],
+            )
+            for match_info in match_infos
+        ])
+        away_team_name_similarities = np.stack([
+            self._get_team_name_similarities(
+                league_name,
+                match_info.away_team,
+                self._away_team_ids[league_name][window],
+                self._away_team_indices[league_name][window],
+            )
+            for match_info in match_infos
+        ])
+        team_name_similarities = (home_team_name_similarities**2 + away_team_name_similarities**2) ** 0.5
+        played_at_distances = np.abs(np.subtract.outer(
+            np.array([match_info.played_at for match_info in match_infos], dtype='datetime64[us]'),
+            np.array(self._played_ats[league_name][window], dtype='datetime64[us]'),
+        )) / np.timedelta64(played_at_precision)
+        valid_assignments = (played_at_distances <= 1) & (team_name_similarities >= team_name_precision)
+        costs = np.where(
+            valid_assignments,
+            _played_at_weight * played_at_distances - team_name_similarities,
+            _invalid_assignment_cost,
+        )
+        # Only candidates nearly as good as the best one, e.g. fixtures of namesakes, are assigned, so that
+        # a scraped match pushed off its best candidate by a duplicate doesn't push off another one in turn.
+        valid_assignments &= costs <= costs.min(axis=1, keepdims=True) + _assignment_cost_margin
+        costs[~valid_assignments] = _invalid_assignment_cost
+        for i, j in zip(*linear_sum_assignment(costs)):
+            # Scraped matches left without valid candidates get invalid ones.
+            if not valid_assignments[i, j]:
+                continue
+            stored_match = stored_matches[j]
+            self._learn_team_alias(
+                league_name,
+                match_infos[i].home_team,
+                stored_match.home_team_id,
+                home_team_name_similarities[i, j],
+            )
+            self._learn_team_alias(
+                league_name,
+                match_infos[i].away_team,
+                stored_match.away_team_id,
+                away_team_name_similarities[i, j],
+            )
+            matches[indices[i]] = stored_match.match
+        return matches
@@ -1,4 +1,3 @@
-import alphabetter.sql.types
 import sqlalchemy as sa
 import alphabetter.sql.types
 
@@ -12,7 +11,7 @@ sql_schema = sa.MetaData()
 team_table = sa.Table(
     'team',
     sql_schema,
-    sa.Column('id', sa.String(36), default=uuid4, unique=True),
+    sa.Column('id', alphabetter.sql.types.UUID(), default=uuid4, unique=True),
     sa.Column('sport', sa.Enum(Sport), primary_key=True),
     sa.Column('country', alphabetter.sql.types.Country(), primary_key=True),
     sa.Column('name', sa.Text(), primary_key=True),
@@ -22,7 +21,7 @@ team_table = sa.Table(
 league_table = sa.Table(
     'league',
     sql_schema,
-    sa.Column('id', sa.String(36), default=uuid4, unique=True),
+    sa.Column('id', alphabetter.sql.types.UUID(), default=uuid4, unique=True),
     sa.Column('sport', sa.Enum(Sport), primary_key=True),
     sa.Column('name', sa.Text(), primary_key=True),
     sa.Column('category', sa.Text()),
@@ -32,8 +31,8 @@ league_table = sa.Table(
 tournament_table = sa.Table(
     'tournament',
     sql_schema,
-    sa.Column('id', sa.String(36), default=uuid4, unique=True),
-    sa.Column('league_id', sa.String(36), sa.ForeignKey(league_table.c.id), primary_key=True),
+    sa.Column('id', alphabetter.sql.types.UUID(), default=uuid4, unique=True),
+    sa.Column('league_id', alphabetter.sql.types.UUID(), sa.ForeignKey(league_table.c.id), primary_key=True),
     sa.Column('season', sa.Text(), primary_key=True),
     sa.Index('tournament_league_idx', 'league_id'),
     sa.Index('tournament_id_idx', 'id'),
@@ -42,16 +41,19 @@ tournament_table = sa.Table(
 match_table = sa.Table(
     'match',
     sql_schema,
-    sa.Column('id', sa.String(36), default=uuid4, unique=True),
+    sa.Column('id', alphabetter.sql.types.UUID(), default=uuid4, unique=True),
     sa.Column('loaded_at', sa.DateTime(), default=datetime.now),
-    sa.Column('tournament_id', sa.String(36), sa.ForeignKey(tournament_table.c.id), primary_key=True),
+    sa.Column('tournament_id', alphabetter.sql.types.UUID(), sa.ForeignKey(tournament_table.c.id), primary_key=True),
     sa.Column('tour', sa.SmallInteger),
     sa.Column('played_at', sa.DateTime(), primary_key=True),
-    sa.Column('home_team_id', sa.String(36), sa.ForeignKey(team_table.c.id), primary_key=True),
-    sa.Column('away_team_id', sa.String(36), sa.ForeignKey(team_table.c.id), primary_key=True),
+    sa.Column('home_team_id', alphabetter.sql.types.UUID(), sa.ForeignKey(team_table.c.id), primary_key=True),
+    sa.Column('away_team_id', alphabetter.sql.types.UUID(), sa.ForeignKey(team_table.c.id), primary_key=True),
     sa.Column('home_points', sa.Integer()),
     sa.Column('away_points', sa.Integer()),
     sa.Index('match_id_idx', 'id'),
+    sa.Index('match_loaded_at_idx', 'loaded_at'),
+    # Both select_dataset and find_match filter matches by a time window.
+    sa.Index('match_played_at_idx', 'played_at'),
 )
 
 odds_table = sa.Table(
@@ -59,7 +61,7 @@ odds_table = sa.Table(
     sql_schema,
     sa.Column('loaded_at', sa.DateTime(), default=datetime.now),
     sa.Column('bookmaker', sa.Enum(Bookmaker), primary_key=True),
-    sa.Column('match_id', sa.String(36), sa.ForeignKey(match_table.c.id), primary_key=True),
+    sa.Column('match_id', alphabetter.sql.types.UUID(), sa.ForeignKey(match_table.c.id), primary_key=True),
     sa.Column('scanned_at', sa.DateTime(), primary_key=True),
     sa.Column('1', sa.Float()),
     sa.Column('X', sa.Float()),
@@ -73,4 +75,44 @@ odds_table = sa.Table(
     sa.CheckConstraint('"1X" IS NULL OR "1X" > 1'),
     sa.CheckConstraint('"12" IS NULL OR "12" > 1'),
     sa.CheckConstraint('"2X" IS NULL OR "2X" > 1'),
+    # Matches with fresh odds are looked up by the loading time alone.
+    sa.Index('odds_loaded_at_idx', 'loaded_at', postgresql_include=['match_id']),
+)
+
+# The latest odds are picked by scanning each match's odds in this order, which needs no heap access.
+sa.Index(
+    'odds_latest_idx',
+    odds_table.c.match_id,
+    odds_table.c.bookmaker,
+    odds_table.c.scanned_at.desc(),
+    postgresql_include=['loaded_at', '1', 'X', '2', '1X', '12', '2X'],
+)
+
+latest_odds_table = sa.Table(
+    'latest_odds',
+    sql_schema,
+    sa.Column('match_id', alphabetter.sql.types.UUID(), sa.ForeignKey(match_table.c.id, ondelete='CASCADE'), primary_key=True),
+    sa.Column('bookmaker', sa.Enum(Bookmaker), primary_key=True),
+    sa.Column('loaded_at', sa.DateTime()),
+    sa.Column('scanned_at', sa.DateTime()),
+    sa.Column('1', sa.Float()),
+    sa.Column('X', sa.Float()),
+    sa.Column('2', sa.Float()),
+    sa.Column('1X', sa.Float()),
+    sa.Column('12', sa.Float()),
+    sa.Column('2X', sa.Float()),
+)
+
+# Names of teams scraped from a source, learned by matching them once, so that they're resolved
+# exactly afterwards.
+team_alias_table = sa.Table(
+    'team_alias',
+    sql_schema,
+    sa.Column('source', sa.Text(), primary_key=True),
+    sa.Column('sport', sa.Enum(Sport), primary_key=True),
+    sa.Column('league_name', sa.Text(), primary_key=True),
+    sa.Column('name', sa.Text(), primary_key=True),
+    sa.Column('team_id', alphabetter.sql.types.UUID(), sa.ForeignKey(team_table.c.id, ondelete='CASCADE'), nullable=False),
+    sa.Column('similarity', sa.Float()),
+    sa.Column('learned_at', sa.DateTime(), default=datetime.now),
 )
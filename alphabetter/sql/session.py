@@ -1,18 +1,114 @@
 import sqlalchemy.orm
 import sqlalchemy as sa
+import alphabetter.sql.types
+import pandas as pd
 import logging
+import io
+import asyncio
+import threading
+import os
 
 from datetime import datetime, timedelta
-from alphabetter.core.model import Sport, Country, Team, Match, Tournament, League
+from alphabetter.core.model import Sport, Country, Match, Odds
+from alphabetter.sql.partitions import is_odds_partitioned, create_odds_partitions
+from alphabetter.sql.resolution import MatchResolver, MatchInfo, query_matches
 from alphabetter.config import default as config
-from difflib import SequenceMatcher
-from typing import Optional, Self
+from typing import Optional, Self, Iterable, Sequence, List, Dict, Any, Callable, TypeVar
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar('T')
+
+# Latest pre-match scan of odds per match and bookmaker.
+_latest_odds_select_query = '''
+    SELECT DISTINCT ON (odds.match_id, odds.bookmaker)
+            odds.match_id,
+            odds.bookmaker,
+            odds.loaded_at,
+            odds.scanned_at,
+            odds."1",
+            odds."X",
+            odds."2",
+            odds."1X",
+            odds."12",
+            odds."2X"
+    FROM odds
+    JOIN match
+        ON odds.match_id = match.id
+    WHERE odds.scanned_at < match.played_at{match_condition}
+    ORDER BY odds.match_id, odds.bookmaker, odds.scanned_at DESC
+    '''
+
+_latest_odds_insert_query = '''
+    INSERT INTO latest_odds (match_id, bookmaker, loaded_at, scanned_at, "1", "X", "2", "1X", "12", "2X")''' + \
+    _latest_odds_select_query
+
+_matches_odds_condition = '''
+        AND odds.match_id IN :match_ids
+        AND odds.scanned_at < :played_before'''
+
+_odds_attributes = {
+    '1': 'home_win',
+    'X': 'draw',
+    '2': 'away_win',
+    '1X': 'home_win_or_draw',
+    '12': 'win',
+    '2X': 'away_win_or_draw',
+}
+
+# Aliases learned concurrently, or learned earlier, are kept as they are.
+_team_alias_insert_query = '''
+    INSERT INTO team_alias (source, sport, league_name, name, team_id, similarity, learned_at)
+    VALUES (:source, :sport, :league_name, :name, :team_id, :similarity, :learned_at)
+    ON CONFLICT DO NOTHING
+    '''
+
+_explain_prefix = 'EXPLAIN (ANALYZE, BUFFERS) '
+
+_engines: Dict[str, sa.engine.Engine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(url: Optional[str] = None) -> sa.engine.Engine:
+    ''' Returns the engine of the database shared by all sessions of the process. '''
+    url = url or config.db_url
+    with _engines_lock:
+        if url not in _engines:
+            pool_args = {}
+            # Dialects without a connection queue, e.g. SQLite, don't accept its size.
+            parsed_url = sa.engine.make_url(url)
+            if issubclass(parsed_url.get_dialect().get_pool_class(parsed_url), sa.pool.QueuePool):
+                pool_args = {'pool_size': config.db_pool_size, 'max_overflow': config.db_max_overflow}
+            _engines[url] = sa.create_engine(url, pool_pre_ping=True, **pool_args)
+            logger.debug(f'Created a database engine for {sa.engine.make_url(url).render_as_string()}.')
+        return _engines[url]
+
+
+def _forget_inherited_engines():
+    # Connections inherited from the parent process must not be used nor closed by a child.
+    for engine in _engines.values():
+        engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_forget_inherited_engines)
+
 
 class SQLSession(sqlalchemy.orm.Session):
+    def get_match_resolver(
+        self,
+        sport: Sport,
+        played_from: datetime,
+        played_to: datetime,
+        league_names: Optional[Iterable[str]] = None,
+        source: Optional[str] = None,
+        alias_precision: float = 0.8,
+    ) -> MatchResolver:
+        ''' Loads the matches played in the given period at once for the lookups of many scraped ones. '''
+        return MatchResolver(self, sport, played_from, played_to, league_names, source, alias_precision)
+
     def find_match(
         self,
         sport: Sport,
@@ -25,46 +121,182 @@ class SQLSession(sqlalchemy.orm.Session):
         played_at_precision: timedelta = timedelta(days=1),
         team_name_precision: float = 0.5,
     ) -> Optional[Match]:
-        HomeTeam = sqlalchemy.orm.aliased(Team)
-        AwayTeam = sqlalchemy.orm.aliased(Team)
-        matches = (self.query(Match)
-            .join(Tournament)
-            .join(League)
-            .join(HomeTeam, Match.home_team)
-            .join(AwayTeam, Match.away_team)
-            .filter(
-                League.sport == sport,
-                League.name == league_name,
-                Match.played_at >= played_at - played_at_precision,
-                Match.played_at <= played_at + played_at_precision,
-                not home_team_country or HomeTeam.country == home_team_country,
-                not away_team_country or AwayTeam.country == away_team_country,
-            )
-            .all()
+        match_resolver = self.get_match_resolver(
+            sport,
+            played_at - played_at_precision,
+            played_at + played_at_precision,
+            [league_name],
         )
-        matches_team_name_similarity = (
-            (
-                match, (
-                    SequenceMatcher(None, match.home_team.name, home_team_name).ratio()**2 +
-                    SequenceMatcher(None, match.away_team.name, away_team_name).ratio()**2
-                ) ** 0.5
-            )
-            for match in matches
+        return match_resolver.find_match(
+            league_name,
+            played_at,
+            home_team_name,
+            away_team_name,
+            home_team_country,
+            away_team_country,
+            played_at_precision,
+            team_name_precision,
+        )
+
+    def find_matches(
+        self,
+        sport: Sport,
+        league_name: str,
+        match_infos: Sequence[MatchInfo],
+        played_at_precision: timedelta = timedelta(days=1),
+        team_name_precision: float = 0.5,
+    ) -> List[Optional[Match]]:
+        ''' Resolves scraped matches of a league with one query. See MatchResolver.find_matches. '''
+        if not match_infos:
+            return []
+        match_resolver = self.get_match_resolver(
+            sport,
+            min(match_info.played_at for match_info in match_infos) - played_at_precision,
+            max(match_info.played_at for match_info in match_infos) + played_at_precision,
+            [league_name],
+        )
+        return match_resolver.find_matches(league_name, match_infos, played_at_precision, team_name_precision)
+
+    def write_team_aliases(self, match_resolver: MatchResolver):
+        ''' Inserts the team aliases learned by the resolver since they were last written. '''
+        team_aliases = match_resolver.pop_learned_team_aliases()
+        if not team_aliases:
+            return
+        learned_at = datetime.now()
+        self.execute(
+            sa.text(_team_alias_insert_query).bindparams(
+                sa.bindparam('sport', type_=sa.Enum(Sport)),
+                sa.bindparam('team_id', type_=alphabetter.sql.types.UUID()),
+            ),
+            [{**team_alias, 'learned_at': learned_at} for team_alias in team_aliases],
         )
-        matches_team_name_similarity = [
-            (match, team_name_similarity)
-            for match, team_name_similarity in matches_team_name_similarity
-            if team_name_similarity >= team_name_precision
-        ]
-        if not matches_team_name_similarity:
-            return None
-        return max(matches_team_name_similarity, key=lambda x: x[1])[0]
+        logger.debug(f'Wrote {len(team_aliases)} team aliases.')
+
+    def refresh_latest_odds(self, matches: Optional[Iterable[Match]] = None):
+        # Only the given matches are refreshed. Without matches, the whole table is rebuilt.
+        if matches is None:
+            self.execute(sa.text('DELETE FROM latest_odds'))
+            self.execute(sa.text(_latest_odds_insert_query.format(match_condition='')))
+            logger.debug('Rebuilt the latest odds.')
+            return
+        self.flush()
+        matches = list(matches)
+        if not matches:
+            return
+        match_ids = [match.id for match in matches] # type: ignore
+        # Only pre-match scans are picked, and a constant bound lets partitions of later scans be pruned.
+        played_before = max(match.played_at for match in matches)
+        match_ids_param = sa.bindparam('match_ids', expanding=True, type_=alphabetter.sql.types.UUID())
+        self.execute(
+            sa.text('DELETE FROM latest_odds WHERE match_id IN :match_ids').bindparams(match_ids_param),
+            {'match_ids': match_ids},
+        )
+        self.execute(
+            sa.text(
+                _latest_odds_insert_query.format(match_condition=_matches_odds_condition)
+            ).bindparams(match_ids_param),
+            {'match_ids': match_ids, 'played_before': played_before},
+        )
+        logger.debug(f'Refreshed the latest odds of {len(match_ids)} matches.')
+
+    def write_odds(self, odds_df: pd.DataFrame, replace: bool = False):
+        ''' Inserts scans of odds given as rows with the columns of the odds table in one batch. '''
+        if odds_df.empty:
+            return
+        # The matches the odds refer to may be pending.
+        self.flush()
+        # Replaced are the earlier scans of the same matches by the same bookmakers, scanned on the
+        # dates of the given ones. Bounding the scanning time lets partitions of other months be pruned.
+        if replace:
+            for bookmaker, bookmaker_odds_df in odds_df.groupby('bookmaker', sort=False):
+                scanned_from = pd.Timestamp(bookmaker_odds_df['scanned_at'].min()).normalize()
+                scanned_to = pd.Timestamp(bookmaker_odds_df['scanned_at'].max()).normalize() + timedelta(days=1)
+                (self.query(Odds)
+                    .filter(
+                        Odds.bookmaker == bookmaker,
+                        Odds.match_id.in_(bookmaker_odds_df['match_id'].unique().tolist()),
+                        Odds.scanned_at >= scanned_from.to_pydatetime(),
+                        Odds.scanned_at < scanned_to.to_pydatetime(),
+                    )
+                    .delete(synchronize_session=False)
+                )
+        # Unlike appending to Match.odds, both ways bypass the unit of work and per-row processing of
+        # parameters by SQLAlchemy.
+        match self.bind.dialect.name:
+            case 'postgresql':
+                connection = self.connection()
+                if is_odds_partitioned(connection):
+                    create_odds_partitions(connection, odds_df['scanned_at'].min(), odds_df['scanned_at'].max())
+                self._copy_odds(odds_df)
+            case _:
+                self.bulk_insert_mappings(Odds, odds_df.rename(columns=_odds_attributes).to_dict('records'))
+        logger.debug(f'Wrote {len(odds_df)} scans of odds.')
+
+    def _copy_odds(self, odds_df: pd.DataFrame):
+        columns = ['loaded_at', 'bookmaker', 'match_id', 'scanned_at', *_odds_attributes]
+        # COPY doesn't apply the defaults and types of the schema, so the values are prepared here.
+        copy_df = odds_df.assign(
+            loaded_at=odds_df['loaded_at'] if 'loaded_at' in odds_df else datetime.now(),
+            bookmaker=odds_df['bookmaker'].map(lambda bookmaker: bookmaker.name),
+            match_id=odds_df['match_id'].astype(str),
+        )
+        buffer = io.StringIO()
+        copy_df[columns].to_csv(buffer, index=False, header=False, na_rep='NaN')
+        buffer.seek(0)
+        column_list = ', '.join(f'"{column}"' for column in columns)
+        with self.connection().connection.cursor() as cursor:
+            cursor.copy_expert(f'COPY odds ({column_list}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+    def explain(self, statement: sa.sql.Executable | str, params: Optional[Dict[str, Any]] = None) -> str:
+        ''' Executes the statement under EXPLAIN ANALYZE and returns its plan. '''
+        connection = self.connection()
+        def prepend_explain(conn, cursor, statement, parameters, context, executemany):
+            return _explain_prefix + statement, parameters
+        # The statement is really executed, so its effects are rolled back with the savepoint. The
+        # savepoint itself must not be explained.
+        savepoint = connection.begin_nested()
+        sa.event.listen(connection, 'before_cursor_execute', prepend_explain, retval=True)
+        try:
+            if isinstance(statement, str):
+                result = connection.exec_driver_sql(statement, params or {})
+            else:
+                result = connection.execute(statement, params or {})
+            # Result processors of the explained statement don't apply to the plan rows.
+            plan = '\n'.join(str(row[0]) for row in result.cursor.fetchall())
+            result.close()
+        finally:
+            sa.event.remove(connection, 'before_cursor_execute', prepend_explain)
+            savepoint.rollback()
+        return plan
+
+    def explain_queries(self) -> Dict[str, str]:
+        ''' Plans of the queries run on every ETL pass, for the most recently played match. '''
+        plans = {
+            'latest odds': self.explain(sa.text(_latest_odds_select_query.format(match_condition=''))),
+        }
+        match = self.query(Match).order_by(Match.played_at.desc()).first()
+        if match is not None:
+            plans['find match'] = self.explain(query_matches(
+                self,
+                match.tournament.league.sport,
+                match.played_at - timedelta(days=1),
+                match.played_at + timedelta(days=1),
+                [match.tournament.league.name],
+            ).statement)
+            match_ids_param = sa.bindparam('match_ids', expanding=True, type_=alphabetter.sql.types.UUID())
+            plans['refresh latest odds'] = self.explain(
+                sa.text(
+                    _latest_odds_select_query.format(match_condition=_matches_odds_condition)
+                ).bindparams(match_ids_param),
+                {'match_ids': [match.id], 'played_before': match.played_at},
+            )
+        return plans
 
     @classmethod
-    def from_url(cls, url: Optional[str] = None) -> Self:
-        db_engine = sa.create_engine(url or config.db_url)
-        sql_session_maker.configure(bind=db_engine)
-        sql_session = sql_session_maker()
+    def from_url(cls, url: Optional[str] = None, *, etl: bool = False) -> Self:
+        ''' ETL sessions neither flush before queries nor expire objects on commit, so they're flushed explicitly. '''
+        session_maker = etl_sql_session_maker if etl else sql_session_maker
+        sql_session = session_maker(bind=get_engine(url))
         assert isinstance(sql_session, cls)
         return sql_session
 
@@ -76,3 +308,52 @@ class SQLSession(sqlalchemy.orm.Session):
 
 
 sql_session_maker = sqlalchemy.orm.sessionmaker(class_=SQLSession, autoflush=True)
+
+# Autoflush makes every query of a bulk load flush the objects added since the previous one.
+etl_sql_session_maker = sqlalchemy.orm.sessionmaker(class_=SQLSession, autoflush=False, expire_on_commit=False)
+
+
+class AsyncSQLSession:
+    ''' Session whose calls run in a dedicated thread, so that the event loop isn't blocked by the database. '''
+
+    def __init__(self, sql_session: SQLSession):
+        self.sync_session = sql_session
+        # A single thread keeps the calls in order, as the session isn't thread-safe.
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix='sql-session')
+
+    async def run_sync(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        ''' Calls the function with the synchronous session and the given arguments in the session thread. '''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(fn, self.sync_session, *args, **kwargs))
+
+    async def get_match_resolver(self, *args, **kwargs) -> MatchResolver:
+        return await self.run_sync(SQLSession.get_match_resolver, *args, **kwargs)
+
+    async def find_match(self, *args, **kwargs) -> Optional[Match]:
+        return await self.run_sync(SQLSession.find_match, *args, **kwargs)
+
+    async def find_matches(self, *args, **kwargs) -> List[Optional[Match]]:
+        return await self.run_sync(SQLSession.find_matches, *args, **kwargs)
+
+    async def write_team_aliases(self, *args, **kwargs):
+        await self.run_sync(SQLSession.write_team_aliases, *args, **kwargs)
+
+    async def write_odds(self, *args, **kwargs):
+        await self.run_sync(SQLSession.write_odds, *args, **kwargs)
+
+    async def refresh_latest_odds(self, *args, **kwargs):
+        await self.run_sync(SQLSession.refresh_latest_odds, *args, **kwargs)
+
+    async def flush(self):
+        await self.run_sync(SQLSession.flush)
+
+    async def commit(self):
+        await self.run_sync(SQLSession.commit)
+
+    async def close(self):
+        await self.run_sync(SQLSession.close)
+        self._executor.shutdown()
+
+    @classmethod
+    def from_url(cls, url: Optional[str] = None, *, etl: bool = False) -> Self:
+        return cls(SQLSession.from_url(url, etl=etl))
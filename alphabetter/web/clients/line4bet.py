@@ -210,7 +210,7 @@ class Line4BetClient:
             future = self._executor.submit(self._extract_odds, page, **odds_extraction_kwargs)
             odds_extractions.append(future)
         for odds_extraction in odds_extractions:
-            events = odds_extraction.result()
+            events = await asyncio.wrap_future(odds_extraction)
             for event in events:
                 yield event
 
@@ -1,4 +1,7 @@
 from subprograms.create_schema import CreateSchemaSubprogram
+from subprograms.explain_queries import ExplainQueriesSubprogram
+from subprograms.benchmark_team_names import BenchmarkTeamNamesSubprogram
+from subprograms.retire_odds import RetireOddsSubprogram
 from subprograms.recommend_bets import RecommendBetsSubprogram
 from subprograms.etl_fonbet_odds import ETLFonbetOddsSubprogram
 from subprograms.etl_line4bet_odds import ETLLine4BetOddsSubprogram
@@ -0,0 +1,36 @@
+import argparse
+
+from pathlib import Path
+from subprogram import Subprogram
+from alphabetter.core import tabulate_df
+from alphabetter.methods import benchmark_team_name_similarity
+
+
+class BenchmarkTeamNamesSubprogram(Subprogram):
+    @classmethod
+    def get_command(cls):
+        return 'benchmark-team-names'
+
+    @classmethod
+    def get_help(cls):
+        return 'compare speed and accuracy of team name similarity measures'
+
+    def __init__(self, arg_parser: argparse.ArgumentParser):
+        super().__init__(arg_parser)
+        arg_parser.add_argument(
+            '--config',
+            type=Path,
+            help='path to a championat config with team aliases',
+        )
+        arg_parser.add_argument(
+            '--repeat',
+            type=int,
+            default=10,
+            metavar='N',
+            help='number of timed passes over the aliases (default - 10)',
+        )
+
+    async def __call__(self, args: argparse.Namespace):
+        await super().__call__(args)
+        benchmark_df = benchmark_team_name_similarity(config_path=args.config, repeat=args.repeat)
+        print(tabulate_df(benchmark_df.reset_index(), index=False))
@@ -1,7 +1,9 @@
 import argparse
+import sqlalchemy as sa
 
 from alphabetter.sql import SQLSession
 from alphabetter.sql.schema import sql_schema
+from alphabetter.sql.migration import migrate_uuid_keys, partition_odds
 from subprogram import Subprogram
 
 
@@ -26,6 +28,11 @@ class CreateSchemaSubprogram(Subprogram):
             action='store_true',
             help='don\'t ask for consent before dropping the schema'
         )
+        arg_parser.add_argument(
+            '--partition-odds',
+            action='store_true',
+            help='partition odds by month of scanning'
+        )
 
     async def __call__(self, args: argparse.Namespace):
         sql_session = SQLSession.from_url()
@@ -44,4 +51,19 @@ class CreateSchemaSubprogram(Subprogram):
                         raise ValueError(f'Invalid answer "{answer}"')
             if confirmed:
                 sql_schema.drop_all(db_engine)
-        sql_schema.create_all(db_engine)
+        with db_engine.begin() as connection:
+            latest_odds_existed = sa.inspect(connection).has_table('latest_odds')
+            # Existing tables are upgraded first, as new ones reference their keys.
+            migrate_uuid_keys(connection)
+            if args.partition_odds:
+                partition_odds(connection)
+            sql_schema.create_all(connection)
+            # Tables created by older versions of the schema lack the indexes added since.
+            for table in sql_schema.sorted_tables:
+                for index in table.indexes:
+                    index.create(connection, checkfirst=True)
+        # Databases created before the latest odds were introduced get them filled here. Once filled,
+        # they are kept for the matches whose odds partitions were retired.
+        if not latest_odds_existed:
+            sql_session.refresh_latest_odds()
+            sql_session.commit()
@@ -0,0 +1,45 @@
+import argparse
+
+from datetime import datetime, timedelta
+from subprogram import Subprogram
+from alphabetter.sql import SQLSession
+from alphabetter.ml import explain_select_dataset
+
+
+class ExplainQueriesSubprogram(Subprogram):
+    @classmethod
+    def get_command(cls):
+        return 'explain-queries'
+
+    @classmethod
+    def get_help(cls):
+        return 'print execution plans of the hot database queries'
+
+    def __init__(self, arg_parser: argparse.ArgumentParser):
+        super().__init__(arg_parser)
+        arg_parser.add_argument(
+            '--played-after',
+            type=datetime.fromisoformat,
+            default=datetime.now() - timedelta(days=365),
+            help='lower bound of the date of selected matches',
+        )
+        arg_parser.add_argument(
+            '--days',
+            type=int,
+            default=365,
+            help='time span in days of selected matches',
+        )
+
+    async def __call__(self, args: argparse.Namespace):
+        await super().__call__(args)
+        sql_session = SQLSession.from_url()
+        plans = {
+            'select dataset': explain_select_dataset(
+                played_after=args.played_after,
+                played_before=args.played_after + timedelta(days=args.days),
+            ),
+            **sql_session.explain_queries(),
+        }
+        sql_session.rollback()
+        for name, plan in plans.items():
+            print(f'-- {name}\n{plan}\n')
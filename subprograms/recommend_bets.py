@@ -69,7 +69,7 @@ class RecommendBetsSubprogram(Subprogram):
     async def __call__(self, args: argparse.Namespace):
         await super().__call__(args)
         logging.log(LOG_LEVEL_STATUS, 'Selecting upcoming matches...')
-        df = select_dataset(played_after=datetime.now())
+        df = select_dataset(played_after=datetime.now(), cache=False).collect()
         logging.info(f'Selected {humanize_match_count(len(df))}.')
         predictor = Predictor.load(args.predictor)
         logging.info(f'Loaded predictor: {predictor}.')
@@ -0,0 +1,43 @@
+import argparse
+import logging
+
+from datetime import datetime
+from subprogram import Subprogram
+from alphabetter.sql import SQLSession
+from alphabetter.sql.partitions import RetentionAction, is_odds_partitioned, retire_odds_partitions
+
+
+class RetireOddsSubprogram(Subprogram):
+    @classmethod
+    def get_command(cls):
+        return 'retire-odds'
+
+    @classmethod
+    def get_help(cls):
+        return 'detach, drop or downsample monthly partitions of old odds'
+
+    def __init__(self, arg_parser: argparse.ArgumentParser):
+        super().__init__(arg_parser)
+        arg_parser.add_argument(
+            '--scanned-before',
+            type=datetime.fromisoformat,
+            required=True,
+            help='upper bound of the scanning time of retired odds',
+        )
+        arg_parser.add_argument(
+            '--action',
+            type=RetentionAction,
+            choices=list(RetentionAction),
+            default=RetentionAction.DETACH,
+            help='what to do with the partitions of retired odds (default - detach)',
+        )
+
+    async def __call__(self, args: argparse.Namespace):
+        await super().__call__(args)
+        sql_session = SQLSession.from_url()
+        connection = sql_session.connection()
+        if not is_odds_partitioned(connection):
+            raise ValueError('Odds are not partitioned. Run create-schema with --partition-odds first.')
+        names = retire_odds_partitions(connection, args.scanned_before, args.action)
+        sql_session.commit()
+        logging.info(f'Retired {len(names)} odds partitions.')
@@ -0,0 +1,113 @@
+import pytest
+
+import alphabetter.core
+from alphabetter.core.model import Sport, Country, Team, League, Tournament, Match
+from alphabetter.sql import SQLSession, MatchInfo
+from alphabetter.sql.schema import sql_schema
+from datetime import datetime
+
+
+@pytest.fixture
+def sql_session(tmp_path):
+    sql_session = SQLSession.from_url(f'sqlite:///{tmp_path / "alphabetter.db"}')
+    sql_schema.create_all(sql_session.bind)
+    yield sql_session
+    sql_session.close()
+
+
+def _add_matches(sql_session, *fixtures):
+    tournament = Tournament(league=League(sport=Sport.FOOTBALL, name='Premier League'), season='2020')
+    teams = {}
+    def get_team(name):
+        return teams.setdefault(name, Team(sport=Sport.FOOTBALL, country=Country('RU'), name=name))
+    for played_at, home_team, away_team in fixtures:
+        Match(
+            tournament=tournament,
+            played_at=played_at,
+            home_team=get_team(home_team),
+            away_team=get_team(away_team),
+            home_points=0,
+            away_points=0,
+        )
+    sql_session.add(tournament)
+    sql_session.commit()
+
+
+def test_duplicate_scrapes_dont_take_other_matches(sql_session):
+    _add_matches(
+        sql_session,
+        (datetime(2020, 1, 2, 15), 'Команда 1', 'Команда 2'),
+        (datetime(2020, 1, 2, 18), 'Команда 3', 'Команда 4'),
+    )
+    match_resolver = sql_session.get_match_resolver(
+        Sport.FOOTBALL,
+        datetime(2020, 1, 1),
+        datetime(2020, 1, 4),
+        ['Premier League'],
+    )
+    matches = match_resolver.find_matches('Premier League', [
+        MatchInfo(datetime(2020, 1, 2, 15), 'Команда 1', 'Команда 2'),
+        MatchInfo(datetime(2020, 1, 2, 15), 'Команда 1', 'Команда 2'),
+        MatchInfo(datetime(2020, 1, 2, 18), 'Команда 3', 'Команда 4'),
+    ])
+    assert [match and (match.home_team.name, match.away_team.name) for match in matches] == [
+        ('Команда 1', 'Команда 2'),
+        None,
+        ('Команда 3', 'Команда 4'),
+    ]
+
+
+def test_scrapes_outside_period_are_unresolved(sql_session):
+    _add_matches(sql_session, (datetime(2020, 1, 2, 15), 'Команда 1', 'Команда 2'))
+    match_resolver = sql_session.get_match_resolver(
+        Sport.FOOTBALL,
+        datetime(2020, 1, 1),
+        datetime(2020, 1, 4),
+        ['Premier League'],
+    )
+    matches = match_resolver.find_matches('Premier League', [
+        MatchInfo(datetime(2021, 1, 2, 15), 'Команда 1', 'Команда 2'),
+        MatchInfo(datetime(2020, 1, 2, 15), 'Команда 1', 'Команда 2'),
+    ])
+    assert matches[0] is None
+    assert matches[1] is not None
+
+
+def test_duplicate_scrapes_dont_push_other_scrapes_off(sql_session):
+    _add_matches(
+        sql_session,
+        (datetime(2020, 1, 2, 10), 'Команда 1', 'Команда 2'),
+        (datetime(2020, 1, 3, 10), 'Команда 1', 'Команда 3'),
+        (datetime(2020, 1, 3, 20), 'Команда 4', 'Команда 3'),
+    )
+    match_resolver = sql_session.get_match_resolver(
+        Sport.FOOTBALL,
+        datetime(2020, 1, 1),
+        datetime(2020, 1, 5),
+        ['Premier League'],
+    )
+    matches = match_resolver.find_matches('Premier League', [
+        MatchInfo(datetime(2020, 1, 2, 10), 'Команда 1', 'Команда 2'),
+        MatchInfo(datetime(2020, 1, 2, 10), 'КОМАНДА 1', 'КОМАНДА 2'),
+        MatchInfo(datetime(2020, 1, 3, 10), 'Команда 1', 'Команда 3'),
+    ])
+    assert [match and (match.home_team.name, match.away_team.name) for match in matches] == [
+        ('Команда 1', 'Команда 2'),
+        None,
+        ('Команда 1', 'Команда 3'),
+    ]
+
+
+def test_scrapes_near_period_bounds_are_resolved(sql_session):
+    _add_matches(sql_session, (datetime(2020, 1, 3, 23), 'Команда 1', 'Команда 2'))
+    match_resolver = sql_session.get_match_resolver(
+        Sport.FOOTBALL,
+        datetime(2020, 1, 1),
+        datetime(2020, 1, 4),
+        ['Premier League'],
+    )
+    matches = match_resolver.find_matches('Premier League', [
+        MatchInfo(datetime(2020, 1, 3, 23), 'Команда 1', 'Команда 2'),
+    ])
+    assert matches[0] is not None
+    assert match_resolver.find_match('Premier League', datetime(2020, 1, 3, 23), 'Команда 1', 'Команда 2') is not None